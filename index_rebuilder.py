@@ -14,11 +14,23 @@ import logging
 import os
 import shutil
 import socket
+import sqlite3
 import subprocess
 import sys
+import time
 
 import lib.database as db
-from lib.common import ConfParser, Mail
+from lib.common import ConfParser, Mail, RecordWriter, parse_size, \
+    pretty_size
+from lib.history import RebuildHistory
+from lib.indexdef import load_rules, match_rule, parse_options
+from lib.journal import RebuildJournal
+from lib.redundancy import REDUNDANT_COLUMNS, find_redundant, \
+    print_findings
+from lib.planner import DEFAULT_THROUGHPUT, days_to_threshold, \
+    estimate_time, select_targets, fits, space_budget, space_need
+from lib.scheduler import FanOutScheduler, RebuildScheduler
+from lib.throttle import LoadGuard, ReplicationThrottle, next_time
 
 #=======================
 #   Parameters block   #
@@ -30,6 +42,9 @@ report_list = []
 # Common params:
 __VERSION__ = '2.4.3'
 HOSTNAME = socket.gethostname()
+# Unused indexes are filtered by recent scans
+# when there are snapshots (see show_stat()):
+MAX_SCAN_COUNTER = 2 ** 63 - 1
 TODAY = datetime.date.today().strftime('%Y%m%d')
 
 
@@ -41,7 +56,18 @@ def parse_cli_args():
                         help="path to configuration FILE", metavar="FILE",
                         default=False)
     parser.add_argument("-d", "--datbase", dest="dbname", default=False,
-                        help="database name", required=True)
+                        help="database name or comma separated "
+                        "list of database names")
+    parser.add_argument("--all-databases", dest="all_databases",
+                        action="store_true",
+                        help="process all databases of the cluster")
+    parser.add_argument("--targets", dest="targets", default=False,
+                        help="process databases listed in FILE "
+                        "as host:port/dbname lines "
+                        "(dbname * means all databases)", metavar="FILE")
+    parser.add_argument("--host-jobs", dest="host_jobs", type=int,
+                        default=1, help="process at most N databases "
+                        "of one host at the same time", metavar="N")
     parser.add_argument("-p", "--port", dest="db_port",
                         help="database port", metavar="PORT")
     parser.add_argument("-H", "--host", dest="db_host",
@@ -52,6 +78,49 @@ def parse_cli_args():
                         help="db user password", metavar="PASSWD")
     parser.add_argument("--verbose", dest="verbose", action="store_true",
                         help="print log messages to the console")
+    parser.add_argument("--output", dest="output", default="table",
+                        choices=["table", "json", "csv"],
+                        help="output format of statistics "
+                        "(json means JSON Lines)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="collect statistics of all databases "
+                        "at the same time (requires psycopg 3)")
+    parser.add_argument("--async-jobs", dest="async_jobs", type=int,
+                        default=20, help="query at most N databases "
+                        "at the same time in --async mode", metavar="N")
+    parser.add_argument("--estimator", dest="estimator", default=None,
+                        choices=["catalog", "pgstattuple", "auto"],
+                        help="bloat estimator of -s and --auto-rebuild: "
+                        "the catalog estimate or pgstatindex() "
+                        "of the biggest indexes (see estimator_time_budget)")
+    parser.add_argument("--progress", dest="progress", type=int, default=0,
+                        help="report progress of index builds "
+                        "every SECONDS", metavar="SECONDS")
+    parser.add_argument("--maintenance-work-mem", dest="maint_mem",
+                        help="max maintenance_work_mem of index builds, "
+                        "scaled with index size", metavar="SIZE")
+    parser.add_argument("--parallel-workers", dest="parallel_workers",
+                        type=int, default=None,
+                        help="max parallel maintenance workers "
+                        "of index builds", metavar="N")
+    parser.add_argument("--work-mem", dest="work_mem",
+                        help="work_mem of index builds", metavar="SIZE")
+    parser.add_argument("--tablespace", dest="tablespace",
+                        help="move rebuilt indexes to TABLESPACE "
+                        "(overrides relocate_file rules)",
+                        metavar="TABLESPACE")
+    parser.add_argument("--storage", dest="storage",
+                        help="change storage parameters of rebuilt "
+                        "indexes: comma separated param=value list, "
+                        "an empty value resets the parameter, "
+                        "tablespace=name is the same as --tablespace",
+                        metavar="PARAMS")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                        help="resume the interrupted batch by the journal "
+                        "(see journal_file)")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="rebuild indexes from FILE by N parallel "
+                        "workers", metavar="N")
 
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-s", "--stat", action="store_true",
@@ -63,14 +132,33 @@ def parse_cli_args():
                        help="show unused indexes with SCAN_COUNTER")
     group.add_argument("-i", "--invalid", action="store_true",
                        help="show invalid indexes")
+    group.add_argument("--redundant", action="store_true",
+                       help="show duplicate indexes and indexes "
+                       "covered by other ones")
     group.add_argument("-r", "--rebuild", dest="index", default=False,
-                       help="rebuild a specified index")
+                       help="rebuild a specified index ([schema.]index)")
     group.add_argument("-f", "--file", dest="filename", default=False,
                        help="rebuild indexes from FILE", metavar="FILE")
+    group.add_argument("--auto-rebuild", dest="auto_rebuild",
+                       action="store_true",
+                       help="rebuild bloated indexes selected "
+                       "by the bloat estimate")
+    group.add_argument("--cleanup", dest="cleanup", action="store_true",
+                       help="drop, swap or rename 'new_' indexes "
+                       "left by interrupted rebuilds")
+    group.add_argument("--serve-metrics", dest="serve_metrics",
+                       action="store_true",
+                       help="serve index metrics for Prometheus "
+                       "(see metrics_port and metrics_interval)")
     group.add_argument("--version", action="version",
                        version=__VERSION__, help="show version and exit")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not (args.dbname or args.all_databases or args.targets):
+        parser.error('one of the arguments -d/--datbase, '
+                     '--all-databases or --targets is required')
+
+    return args
 
 args = parse_cli_args()
 
@@ -80,6 +168,11 @@ args = parse_cli_args()
 
 # Allowable parameters list in the config file:
 params = ['lock_query_timeo',
+          'lock_retries',
+          'lock_retry_delay',
+          'lock_retry_max_delay',
+          'lock_deadline',
+          'cancel_blockers_after',
           'log_dir',
           'log_pref',
           'mail_allow',
@@ -89,7 +182,40 @@ params = ['lock_query_timeo',
           'smtp_srv',
           'smtp_port',
           'smtp_pass',
-          'mail_sender']
+          'mail_sender',
+          'auto_min_bloat',
+          'auto_min_ratio',
+          'auto_max_size',
+          'auto_time_budget',
+          'rebuild_throughput',
+          'history_db',
+          'maint_window',
+          'rebuild_engine',
+          'maintenance_work_mem',
+          'max_parallel_maintenance_workers',
+          'work_mem',
+          'metrics_addr',
+          'metrics_port',
+          'metrics_interval',
+          'estimator',
+          'estimator_time_budget',
+          'trend_window',
+          'journal_file',
+          'max_replica_lag',
+          'max_replica_lag_bytes',
+          'max_wal_rate',
+          'throttle_interval',
+          'max_active_backends',
+          'max_lock_waits',
+          'max_io_rate',
+          'max_checkpoint_rate',
+          'stop_at',
+          'partition_min_writes',
+          'partition_min_ratio',
+          'space_headroom',
+          'tablespace_free',
+          'relocate_file',
+          'prepared_statements']
 
 conf_parser = ConfParser()
 conf_parser.set_params(params)
@@ -97,11 +223,36 @@ conf_parser.set_config(args.config)
 configuration = conf_parser.get_options()
 
 # Main params:
-# Statement timeout (in this util used for drop/alter SQL only):
+# Lock timeout of one attempt of drop/alter SQL:
 LOCK_QUERY_TIMEO = '0'
 if configuration['lock_query_timeo']:
     LOCK_QUERY_TIMEO = configuration['lock_query_timeo']
 
+# Rebuilding engine: auto (native on PostgreSQL 12+), native or legacy:
+REBUILD_ENGINE = configuration.get('rebuild_engine', 'auto')
+
+# Lock acquisition retries for drop/alter SQL:
+LOCK_RETRIES = int(configuration.get('lock_retries', 1))
+LOCK_RETRY_DELAY = float(configuration.get('lock_retry_delay', 1))
+LOCK_RETRY_MAX_DELAY = float(configuration.get('lock_retry_max_delay', 60))
+LOCK_DEADLINE = float(configuration.get('lock_deadline', 0))
+CANCEL_BLOCKERS_AFTER = int(configuration.get('cancel_blockers_after', 0))
+
+# Catalog queries are prepared once per connection, set it to 0
+# if the connection goes through a transaction pooler:
+PREPARED_STATEMENTS = bool(int(configuration.get('prepared_statements', 1)))
+
+# Session settings of index builds (CLI args override them),
+# maintenance_work_mem and parallel workers are scaled with index size
+# up to the values below:
+MAINT_MEM = parse_size(args.maint_mem or
+                       configuration.get('maintenance_work_mem', 0))
+PARALLEL_WORKERS = args.parallel_workers
+if PARALLEL_WORKERS is None and \
+        configuration.get('max_parallel_maintenance_workers'):
+    PARALLEL_WORKERS = int(configuration['max_parallel_maintenance_workers'])
+WORK_MEM = parse_size(args.work_mem or configuration.get('work_mem', 0))
+
 # Log params:
 LOG_DIR = configuration['log_dir']
 LOG_PREF = configuration['log_pref']
@@ -116,6 +267,98 @@ SMTP_PORT = configuration['smtp_port']
 SMTP_PASS = configuration['smtp_pass']
 SENDER = configuration['mail_sender']
 
+# Auto rebuild params (see the --auto-rebuild arg):
+AUTO_MIN_BLOAT = parse_size(configuration.get('auto_min_bloat', '1MB'))
+AUTO_MIN_RATIO = float(configuration.get('auto_min_ratio', 30))
+AUTO_MAX_SIZE = parse_size(configuration.get('auto_max_size', 0))
+AUTO_TIME_BUDGET = int(configuration.get('auto_time_budget', 0))
+REBUILD_THROUGHPUT = parse_size(configuration.get('rebuild_throughput',
+                                                  DEFAULT_THROUGHPUT))
+
+# Bloat estimator: catalog, pgstattuple or auto (the CLI arg overrides it)
+# and the time in seconds pgstatindex() measurements can take (0 - no limit):
+ESTIMATOR = args.estimator or configuration.get('estimator', 'catalog')
+ESTIMATOR_TIME_BUDGET = int(configuration.get('estimator_time_budget', 60))
+
+# Rebuild history params (for rebuild time predictions):
+HISTORY_DB = configuration.get('history_db', '')
+# Bloat growth and recent usage are computed by the index statistics
+# snapshots of the last days:
+TREND_WINDOW = int(configuration.get('trend_window', 7))
+# Maintenance window duration in seconds (0 - no limit):
+MAINT_WINDOW = int(configuration.get('maint_window', 0))
+
+# Wall-clock time 'HH:MM' after which new rebuilds aren't started:
+STOP_AT = configuration.get('stop_at', '')
+
+START_TIME = datetime.datetime.now()
+DEADLINE = None
+if MAINT_WINDOW:
+    DEADLINE = START_TIME + datetime.timedelta(seconds=MAINT_WINDOW)
+if STOP_AT:
+    stop_time = next_time(STOP_AT, START_TIME)
+    DEADLINE = min(DEADLINE, stop_time) if DEADLINE else stop_time
+
+# Metrics exporter params (see the --serve-metrics arg):
+METRICS_ADDR = configuration.get('metrics_addr', '')
+METRICS_PORT = int(configuration.get('metrics_port', 9816))
+METRICS_INTERVAL = int(configuration.get('metrics_interval', 60))
+
+history = None
+if HISTORY_DB:
+    try:
+        history = RebuildHistory(HISTORY_DB)
+    except sqlite3.Error as e:
+        print('Cannot open history_db %s: %s' % (HISTORY_DB, e))
+        sys.exit(1)
+
+# Replication lag throttle: new rebuilds aren't started while
+# the replay lag (seconds, bytes) is above the limits and concurrency
+# is lowered while WAL is generated faster (0 - no limit):
+MAX_REPLICA_LAG = float(configuration.get('max_replica_lag', 0))
+MAX_REPLICA_LAG_BYTES = parse_size(configuration.get('max_replica_lag_bytes',
+                                                     0))
+MAX_WAL_RATE = parse_size(configuration.get('max_wal_rate', 0))
+THROTTLE_INTERVAL = int(configuration.get('throttle_interval', 10))
+
+# Load limits: new rebuilds wait while the server is busier
+# (0 - no limit), the checkpoint rate is per hour:
+MAX_ACTIVE_BACKENDS = int(configuration.get('max_active_backends', 0))
+MAX_LOCK_WAITS = int(configuration.get('max_lock_waits', 0))
+MAX_IO_RATE = parse_size(configuration.get('max_io_rate', 0))
+MAX_CHECKPOINT_RATE = float(configuration.get('max_checkpoint_rate', 0))
+
+# Partitions of partitioned indexes with fewer rows written since
+# the statistics reset (cold) or with lower estimated bloat ratio
+# (percent) aren't rebuilt:
+PARTITION_MIN_WRITES = int(configuration.get('partition_min_writes', 1))
+PARTITION_MIN_RATIO = float(configuration.get('partition_min_ratio', 10))
+
+# Disk space pre-flight: index builds running at the same time
+# may take the free space of tablespaces except space_headroom percent.
+# The free space is checked on the local host, tablespace_free sets it
+# for remote servers as 'tablespace:size, ...' lines:
+SPACE_HEADROOM = float(configuration.get('space_headroom', 20))
+TABLESPACE_FREE = {}
+for item in configuration.get('tablespace_free', '').split(','):
+    if item.strip():
+        ts, size = item.rsplit(':', 1)
+        TABLESPACE_FREE[ts.strip()] = parse_size(size.strip())
+
+# Relocation: rebuilt indexes are moved to other tablespaces
+# and get other storage parameters by the rules of the file
+# and by the --tablespace and --storage args:
+RELOCATE_FILE = configuration.get('relocate_file', '')
+RELOCATE_RULES = load_rules(RELOCATE_FILE) if RELOCATE_FILE else []
+# tablespace=name in --storage is the same as --tablespace name:
+CLI_TABLESPACE, CLI_STORAGE = parse_options(args.storage.split(',')) \
+    if args.storage else (None, {})
+
+# Journal of rebuilding steps for the --resume arg
+# (empty - no journal):
+JOURNAL_FILE = configuration.get('journal_file', '')
+journal = None
+
 # The DB defaults are below.
 # In the DatBase.get_connect() class method
 # the database name for connection is 'postgres' by default):
@@ -144,20 +387,847 @@ if args.db_passwd:
 #   FUNCTIONS & CLASSES   #
 #==========================
 
-def main():
-    #
-    # If stat argument is passed:
-    #
-    if (args.stat or args.invalid or
-        args.scan_counter or args.new):
-        idx_stat = db.GlobIndexStat(args.dbname)
-        #idx_stat.set_log(log)
-        idx_stat.get_connect(con_type=DB_CONTYPE, host=DB_HOST,
-                             pg_port=DB_PORT, user=DB_USER,
-                             passwd=DB_PASSWD)
+def make_target(dbname, host='', port=''):
+    """Make a description of a database to process"""
+    con_type = DB_CONTYPE
+    if host:
+        con_type = 'network' if host != 'localhost' else 'u_socket'
+    else:
+        host = DB_HOST
+
+    if con_type == 'u_socket':
+        host = ''
+
+    return {'dbname': dbname,
+            'con_type': con_type,
+            'host': host,
+            'port': port or DB_PORT}
+
+
+def target_name(target):
+    return '%s@%s:%s' % (target['dbname'], target['host'] or 'localhost',
+                         target['port'])
+
+
+def make_session(target, log=None):
+    """Make a database session that can be shared
+    between database objects of one run (or of one worker)
+    """
+    session = db.Session(target['dbname'], con_type=target['con_type'],
+                         host=target['host'], pg_port=target['port'],
+                         user=DB_USER, passwd=DB_PASSWD)
+    session.set_prepared(PREPARED_STATEMENTS)
+    if log:
+        session.set_log(log)
+
+    return session
+
+
+def make_worker_session(target, log, throttle=None):
+    """Make the session of a rebuild worker, progress of its builds
+    is polled on one more session (see the --progress arg),
+    both are opened once for all indexes of the worker
+    """
+    session = make_session(target, log)
+    if args.progress:
+        monitor = db.ProgressMonitor(make_session(target, log), args.progress)
+        monitor.set_log(log)
+        if args.verbose:
+            monitor.set_verbosity(True)
+        if throttle:
+            monitor.add_hook(throttle.progress_hook)
+        session.set_monitor(monitor)
+
+    return session
+
+
+def discover_databases(host='', port=''):
+    """Get targets for all databases of the cluster"""
+    target = make_target('postgres', host, port)
+    session = make_session(target)
+    dbobj = db.DatBaseObject('postgres')
+    if not dbobj.set_session(session):
+        print('Connection to %s failed' % target_name(target))
+        return []
+
+    dbnames = dbobj.get_databases()
+    dbobj.close_connect()
+    session.close_connect()
+    return [make_target(d, host, port) for d in dbnames]
+
+
+def get_targets():
+    """Get the list of databases to process from the passed args"""
+    targets = []
+    if args.dbname:
+        for dbname in args.dbname.split(','):
+            if dbname.strip():
+                targets.append(make_target(dbname.strip()))
+
+    if args.all_databases:
+        targets += discover_databases()
+
+    if args.targets:
+        try:
+            fp = open(args.targets, 'r')
+        except IOError as e:
+            print(e)
+            sys.exit(e.errno)
+
+        for line in fp:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+
+            # host:port/dbname
+            hostport, _, dbname = line.partition('/')
+            host, _, port = hostport.partition(':')
+            if dbname == '*':
+                targets += discover_databases(host, port)
+            else:
+                targets.append(make_target(dbname, host, port))
+
+        fp.close()
+
+    return targets
+
+
+def predict_time(meta):
+    """Predict rebuild time (in seconds) of an index by its metadata"""
+    if history:
+        return history.predict(meta['amname'], meta['relsize'],
+                               REBUILD_THROUGHPUT)
+
+    return estimate_time(meta['relsize'], REBUILD_THROUGHPUT)
+
+
+def set_lock_params(index):
+    """Set lock timeout and retries of drop/alter SQL"""
+    index.set_lock_query_timeo(LOCK_QUERY_TIMEO)
+    index.set_lock_strategy(retries=LOCK_RETRIES, delay=LOCK_RETRY_DELAY,
+                            max_delay=LOCK_RETRY_MAX_DELAY,
+                            deadline=LOCK_DEADLINE,
+                            cancel_after=CANCEL_BLOCKERS_AFTER)
+
+
+def make_throttle(target, log):
+    """Make the replication lag throttle of the target
+    with its own session, None if no limits are set
+    """
+    if not (MAX_REPLICA_LAG or MAX_REPLICA_LAG_BYTES or MAX_WAL_RATE):
+        return None
+
+    dbobj = db.DatBaseObject(target['dbname'])
+    dbobj.set_log(log)
+    if not dbobj.set_session(make_session(target, log)):
+        return None
+
+    if dbobj.server_version < (10,):
+        log.warning('Replication lag throttling requires PostgreSQL 10+')
+        dbobj.session.close_connect()
+        return None
+
+    return ReplicationThrottle(dbobj, args.jobs, MAX_REPLICA_LAG,
+                               MAX_REPLICA_LAG_BYTES, MAX_WAL_RATE,
+                               THROTTLE_INTERVAL)
+
+
+def make_load_guard(target, log):
+    """Make the load guard of the target with its own session,
+    None if no load limits and no deadline are set
+    """
+    limits = (MAX_ACTIVE_BACKENDS or MAX_LOCK_WAITS or MAX_IO_RATE or
+              MAX_CHECKPOINT_RATE)
+    if not (limits or DEADLINE):
+        return None
+
+    dbobj = db.DatBaseObject(target['dbname'])
+    dbobj.set_log(log)
+    if limits:
+        if not dbobj.set_session(make_session(target, log)):
+            return None
+
+        if dbobj.server_version < (10,):
+            log.warning('Load limits require PostgreSQL 10+')
+            dbobj.session.close_connect()
+            return None
+
+        return LoadGuard(dbobj, MAX_ACTIVE_BACKENDS, MAX_LOCK_WAITS,
+                         MAX_IO_RATE, MAX_CHECKPOINT_RATE, DEADLINE,
+                         THROTTLE_INTERVAL)
+
+    return LoadGuard(dbobj, deadline=DEADLINE)
+
+
+def relocation(indexname):
+    """Get (tablespace, storage) the index is moved to by the rebuild,
+    the args override the rules of relocate_file
+    """
+    tablespace, storage = match_rule(RELOCATE_RULES, indexname)
+    return (args.tablespace or CLI_TABLESPACE or tablespace,
+            dict(storage, **CLI_STORAGE))
+
+
+def rebuild_index(target, indexname, session, log, log_fname, meta=None,
+                  throttle=None):
+    """Rebuild the index by using the shared session,
+    returns a line for the report
+    """
+    # Don't start rebuilding that won't finish
+    # inside the maintenance window:
+    if DEADLINE and meta:
+        est_time = predict_time(meta)
+        if (datetime.datetime.now() +
+                datetime.timedelta(seconds=est_time) > DEADLINE):
+            msg = '%s: skipped, predicted rebuild time %ds exceeds '\
+                  'the maintenance window' % (indexname, est_time)
+            log.warning(msg)
+            return msg+'\n'
+
+    index = db.Index(indexname, target['dbname'])
+    index.set_log(log)
+    if meta:
+        index.set_meta(meta)
+    if journal:
+        resume = None
+        if args.resume:
+            resume = journal.last(target_name(target), indexname)
+        index.set_journal(journal, target_name(target), resume)
+    if args.verbose:
+        index.set_verbosity(True)
+
+    # Progress of the build is polled by the monitor of the worker:
+    if session.monitor:
+        index.set_progress_monitor(session.monitor)
+
+    if index.set_session(session):
+        set_lock_params(index)
+        index.set_engine(REBUILD_ENGINE)
+        index.set_relocation(*relocation(indexname))
+        index.set_tuning(max_mem=MAINT_MEM, max_workers=PARALLEL_WORKERS,
+                         work_mem=WORK_MEM)
+        stat = index.rebuild()
+        index.close_connect()
+        if stat:
+            if history and meta:
+                history.add(target['dbname'], indexname, meta['amname'],
+                            index.prev_size, index.fin_size,
+                            index.exec_time.total_seconds())
+            return stat+'\n'
+        else:
+            return 'Rebuilding %s failed. '\
+                   'See %s for more info\n' % (indexname, log_fname)
+    else:
+        return 'Connection to the database '\
+               '%s failed\n' % target_name(target)
+
+
+def get_free_space(target, dbobj, log):
+    """Get free space (bytes) of tablespaces as a dictionary
+    {tablespace: bytes}. Directories of tablespaces are checked
+    if the server is local, the tablespace_free param is used
+    for the rest
+    """
+    free = dict(TABLESPACE_FREE)
+    if target['con_type'] != 'u_socket':
+        return free
+
+    paths = dbobj.get_tablespaces()
+    if paths is None:
+        log.warning('Directories of tablespaces are unavailable, '
+                    'the data directory is readable by superusers '
+                    'and pg_read_all_settings members only')
+        return free
+
+    for ts, path in paths.items():
+        try:
+            st = os.statvfs(path)
+        except OSError as e:
+            log.warning('Free space of the tablespace %s '
+                        'is unknown: %s' % (ts, e))
+            continue
+
+        free[ts] = st.f_bavail * st.f_frsize
+
+    return free
+
+
+def check_space(target, dbobj, indexnames, imeta, log):
+    """Check that every index of the list can be built
+    within the space budget of its tablespace and of the temp
+    tablespace. Returns the list of indexes which fit,
+    the space cost function of the scheduler (None if the space
+    isn't limited), the budget and the report lines
+    """
+    budget = space_budget(get_free_space(target, dbobj, log),
+                          SPACE_HEADROOM)
+    if not budget:
+        log.warning('%s: free space of tablespaces is unknown, '
+                    'the disk space check is skipped' % target_name(target))
+        return indexnames, None, None, []
+
+    default_ts = dbobj.get_default_tablespace()
+    temp_ts = dbobj.get_temp_tablespace()
+
+    def cost(iname):
+        if iname not in imeta:
+            return {}
+
+        # The new copy is built in the tablespace the index is moved to:
+        tablespace = relocation(iname)[0] or imeta[iname]['tablespace']
+        return space_need(imeta[iname]['relsize'],
+                          tablespace or default_ts, temp_ts, MAINT_MEM)
+
+    report = []
+    result = []
+    total = {}
+    for i in indexnames:
+        need = cost(i)
+        if not fits(need, budget):
+            msg = '%s: skipped, the build needs %s, there is %s '\
+                  'within the headroom' % (i, ', '.join(
+                      '%s in %s' % (pretty_size(n), ts)
+                      for ts, n in sorted(need.items())), ', '.join(
+                      '%s in %s' % (pretty_size(budget[ts]), ts)
+                      for ts in sorted(need) if ts in budget))
+            log.error(msg)
+            report.append(msg+'\n')
+            continue
+
+        result.append(i)
+        for ts, n in need.items():
+            total[ts] = total.get(ts, 0) + n
+
+    for ts, n in sorted(total.items()):
+        if ts not in budget:
+            continue
+
+        msg = '%s: the batch needs up to %s in the tablespace %s, '\
+              '%s is available within the headroom' % (
+                  target_name(target), pretty_size(n), ts,
+                  pretty_size(budget[ts]))
+        if n > budget[ts]:
+            msg += ', concurrent rebuilds are limited by the space'
+        log.info(msg)
+
+    return result, cost, budget, report
+
+
+def skip_resumed(target, indexnames, log):
+    """Skip indexes rebuilt by the resumed batch,
+    returns the rest of the list and the report lines
+    """
+    if not args.resume:
+        return indexnames, []
+
+    todo = []
+    report = []
+    for i in indexnames:
+        entry = journal.last(target_name(target), i)
+        if entry and entry['step'] in ('renamed', 'done'):
+            msg = '%s: skipped, rebuilt by the resumed batch' % i
+            log.info(msg)
+            report.append(msg+'\n')
+        else:
+            todo.append(i)
+
+    return todo, report
+
+
+def partition_ratios(idx_stat, parts, bloat, log):
+    """Get bloat ratios of the partition indexes as a dictionary
+    {index: ratio or None}. The catalog estimate covers non-unique
+    btree indexes of the public schema only, other btree indexes
+    are measured by pgstatindex() if the estimator allows it
+    while estimator_time_budget isn't spent. None means unknown
+    """
+    ratios = dict((p['index'], bloat.get(p['index'])) for p in parts)
+    if ESTIMATOR == 'catalog' or not idx_stat.has_extension('pgstattuple'):
+        return ratios
+
+    start = time.time()
+    for p in parts:
+        if ratios[p['index']] is not None or p['amname'] != 'btree':
+            continue
+
+        if ESTIMATOR_TIME_BUDGET:
+            left = ESTIMATOR_TIME_BUDGET - (time.time() - start)
+            if left <= 0:
+                log.warning('Bloat of the rest of partition indexes '
+                            'is not measured, estimator_time_budget '
+                            'is spent')
+                break
+            # Don't let one huge index exceed the budget:
+            idx_stat.set_statement_timeout('%dms' % (left * 1000))
+
+        m = idx_stat.measure_bloat(p['schema'], p['relname'])
+        if m is None:
+            break
+
+        size, index_bloat = m
+        ratios[p['index']] = 100.0 * index_bloat / size if size else 0
+
+    if ESTIMATOR_TIME_BUDGET:
+        idx_stat.set_statement_timeout(0)
+
+    return ratios
+
+
+def expand_partitioned(target, dbobj, indexnames, imeta, log):
+    """Replace partitioned indexes of the list by indexes
+    of their partitions which need rebuilding, cold partitions
+    and partitions without bloat are skipped, partitions
+    with unknown bloat are rebuilt. Metadata of the partition
+    indexes is added to imeta. Returns the new list and the report lines
+    """
+    report = []
+    result = []
+
+    idx_stat = None
+    bloat = {}
+    if PARTITION_MIN_RATIO:
+        idx_stat = db.GlobIndexStat(target['dbname'])
+        idx_stat.set_log(log)
+        idx_stat.set_session(dbobj.session)
+        bloat = dict((db.join_name(r['schema'], r['index']), r['ratio'])
+                     for r in idx_stat.iter_bloat())
+
+    for iname in indexnames:
+        if iname not in imeta or imeta[iname]['relkind'] != 'I':
+            result.append(iname)
+            continue
+
+        # Indexes of partitions stay attached after REINDEX CONCURRENTLY:
+        if dbobj.server_version < (12,):
+            msg = '%s: partitioned indexes can be rebuilt '\
+                  'on PostgreSQL 12+ only' % iname
+            log.error(msg)
+            report.append(msg+'\n')
+            continue
+
+        parts = dbobj.get_index_partitions(iname)
+        cold = [p for p in parts if p['writes'] < PARTITION_MIN_WRITES]
+        warm = [p for p in parts if p['writes'] >= PARTITION_MIN_WRITES]
+
+        ratios = {}
+        if idx_stat:
+            ratios = partition_ratios(idx_stat, warm, bloat, log)
+
+        # Partitions without the estimate (unique, non-btree indexes,
+        # indexes of other schemas) aren't treated as not bloated:
+        unknown = [p['index'] for p in warm
+                   if ratios.get(p['index']) is None]
+        selected = [p['index'] for p in warm
+                    if ratios.get(p['index']) is None or
+                    ratios[p['index']] >= PARTITION_MIN_RATIO]
+
+        msg = '%s: partitioned index, %s of %s partition indexes selected '\
+              '(%s cold, %s not bloated' % (iname, len(selected), len(parts),
+                                            len(cold),
+                                            len(warm) - len(selected))
+        if idx_stat and unknown:
+            msg += ', %s with unknown bloat' % len(unknown)
+        msg += ')'
+        print(msg)
+        log.info(msg)
+        report.append(msg+'\n')
+        result += selected
+
+    if idx_stat:
+        idx_stat.close_connect()
+
+    imeta.update(dbobj.get_indexes_meta([i for i in result
+                                         if i not in imeta]))
+    return result, report
+
+
+def check_parents(target, parents, log):
+    """Check that the partitioned indexes are still valid
+    after rebuilding of their partitions, returns the report lines
+    """
+    session = make_session(target, log)
+    report = []
+    for iname in parents:
+        index = db.Index(iname, target['dbname'])
+        index.set_log(log)
+        if not index.set_session(session):
+            break
+
+        if index.check_validity():
+            msg = '%s: partitioned index is valid' % iname
+            log.info(msg)
+        else:
+            msg = '%s: partitioned index is INVALID. Check it' % iname
+            log.warning(msg)
+        report.append(msg+'\n')
+        index.close_connect()
+
+    session.close_connect()
+    return report
+
+
+def rebuild_indexes(target, indexnames, log, log_fname):
+    """Rebuild the list of indexes by the scheduler,
+    returns the report lines in the order of the list
+    """
+    # Skip indexes rebuilt by the interrupted run:
+    indexnames, report = skip_resumed(target, indexnames, log)
+    if not indexnames:
+        return report
+
+    # Preflight: get metadata of all the indexes by one query.
+    # Tables of the indexes are also used to avoid
+    # concurrent rebuilding of indexes of the same table:
+    session = make_session(target, log)
+    dbobj = db.DatBaseObject(target['dbname'])
+    dbobj.set_log(log)
+    if not dbobj.set_session(session):
+        return ['Connection to the database '
+                '%s failed\n' % target_name(target)]
+
+    imeta = dbobj.get_indexes_meta(indexnames)
+
+    # Partitioned indexes are replaced by indexes of their partitions:
+    parents = [i for i in indexnames
+               if i in imeta and imeta[i]['relkind'] == 'I']
+    if parents:
+        indexnames, lines = expand_partitioned(target, dbobj, indexnames,
+                                               imeta, log)
+        report += lines
+        indexnames, lines = skip_resumed(target, indexnames, log)
+        report += lines
+
+    # A concurrent build needs space for the new copy of the index
+    # and for sort temp files:
+    indexnames, space_cost, budget, lines = check_space(
+        target, dbobj, indexnames, imeta, log)
+    report += lines
+
+    dbobj.close_connect()
+    session.close_connect()
+    if not indexnames:
+        return report
+
+    # Batch ETA by the rebuild history:
+    est_time = sum(predict_time(imeta[i]) for i in indexnames
+                   if i in imeta)
+    est_time /= max(min(args.jobs, len(indexnames)), 1)
+    finish = datetime.datetime.now() + \
+        datetime.timedelta(seconds=est_time)
+    msg = '%s: estimated rebuilding time of %s indexes: %s '\
+          '(finish at ~%s)' % (target_name(target), len(indexnames),
+                               datetime.timedelta(seconds=int(est_time)),
+                               finish.strftime('%Y-%m-%d %H:%M:%S'))
+    print(msg)
+    log.info(msg)
+
+    # Every worker opens its own session once
+    # and uses it for all indexes it rebuilds:
+    scheduler = RebuildScheduler(args.jobs)
+    # New rebuilds wait while the replicas are lagging behind
+    # or the server is busy and aren't started after the deadline:
+    throttle = make_throttle(target, log)
+    if throttle:
+        scheduler.add_gate(throttle)
+
+    guard = make_load_guard(target, log)
+    if guard:
+        scheduler.add_gate(guard)
+
+    # Builds running at the same time must fit the free space:
+    if space_cost:
+        scheduler.set_budget(budget, space_cost)
+
+    tasks = [(i, imeta[i]['itable'] if i in imeta else None)
+             for i in indexnames]
+    results = scheduler.run(
+        tasks, lambda i, s: rebuild_index(target, i, s, log, log_fname,
+                                          imeta.get(i), throttle),
+        make_session=lambda: make_worker_session(target, log, throttle))
+
+    for gate in (throttle, guard):
+        if gate and gate.dbobj.session:
+            gate.dbobj.close_connect()
+            gate.dbobj.session.close_connect()
+
+    for indexname, stat in zip(indexnames, results):
+        if indexname in scheduler.skipped:
+            stat = '%s: skipped, the deadline is reached\n' % indexname
+        elif stat is None:
+            stat = 'Rebuilding %s failed. '\
+                   'See %s for more info\n' % (indexname, log_fname)
+        report.append(stat)
+
+    if parents:
+        report += check_parents(target, parents, log)
+
+    return report
+
+
+def auto_rebuild(target, log, log_fname):
+    """Rebuild indexes of the target selected by the bloat estimate,
+    returns the report lines
+    """
+    session = make_session(target, log)
+    idx_stat = db.GlobIndexStat(target['dbname'])
+    idx_stat.set_log(log)
+    if not idx_stat.set_session(session):
+        return ['Connection to the database '
+                '%s failed\n' % target_name(target)]
+
+    candidates = idx_stat.get_bloat_stat(ESTIMATOR, ESTIMATOR_TIME_BUDGET)
+    idx_stat.close_connect()
+    session.close_connect()
+
+    throughput = None
+    if history:
+        throughput = history.throughput('btree')
+
+    targets = select_targets(candidates, min_bloat=AUTO_MIN_BLOAT,
+                             min_ratio=AUTO_MIN_RATIO,
+                             max_size=AUTO_MAX_SIZE,
+                             time_budget=AUTO_TIME_BUDGET,
+                             throughput=throughput or REBUILD_THROUGHPUT)
+
+    print('%s: selected %s of %s bloated indexes:' % (
+        target_name(target), len(targets), len(candidates)))
+    for t in targets:
+        msg = '%s: size %s, bloat %s (%s%%), est. time %ds' % (
+            t['index'], t['size'], t['bloat'], t['ratio'], t['est_time'])
+        print(msg)
+        log.info('Auto rebuild target %s' % msg)
+
+    # The same index name can be used in several schemas:
+    return rebuild_indexes(target, [db.join_name(t['schema'], t['index'])
+                                    for t in targets], log, log_fname)
+
+
+def journaled(target, orphan):
+    """Is the rebuild of the original index of the orphan
+    recorded by the last batch of the journal
+    """
+    if not journal:
+        return False
+
+    return any(journal.last(target_name(target), name)
+               for name in (db.join_name(orphan['schema'], orphan['index']),
+                            orphan['index']))
+
+
+def cleanup(target, log, log_fname):
+    """Drop, swap or rename 'new_' indexes of the target
+    left by interrupted rebuilds, returns the report lines
+    """
+    session = make_session(target, log)
+    dbobj = db.DatBaseObject(target['dbname'])
+    dbobj.set_log(log)
+    if not dbobj.set_session(session):
+        return ['Connection to the database '
+                '%s failed\n' % target_name(target)]
+
+    orphans = dbobj.get_orphans('new_')
+    dbobj.close_connect()
+
+    report = []
+    freed = 0
+    writes = 0
+    for o in orphans:
+        # A valid new_ index without the original one may be an own
+        # index, it's renamed only if the journal has the rebuild:
+        if o['tmp_valid'] and not o['orig_exists'] and \
+                not journaled(target, o):
+            msg = '%s: skipped, %s does not exist and its rebuild '\
+                  'is not in the journal. Rename it manually if it\'s '\
+                  'left by a rebuild' % (o['tmp_name'], o['index'])
+            log.warning(msg)
+            report.append(msg+'\n')
+            continue
+
+        index = db.Index(db.join_name(o['schema'], o['index']),
+                         target['dbname'])
+        index.set_log(log)
+        if args.verbose:
+            index.set_verbosity(True)
+        index.set_session(session)
+        set_lock_params(index)
+
+        action = index.recover(o)
+        index.close_connect()
+        if not action:
+            report.append('%s: NOT recovered. See %s '
+                          'for more info\n' % (o['tmp_name'], log_fname))
+            continue
+
+        # The dropped index doesn't take space
+        # and isn't updated by writes anymore:
+        size = 0
+        if action == 'dropped':
+            size = o['tmp_size']
+        elif action == 'swapped':
+            size = o['orig_size']
+
+        if size:
+            freed += size
+            writes += o['writes']
+
+        msg = '%s: %s, %s freed' % (o['tmp_name'], action, pretty_size(size))
+        log.info(msg)
+        report.append(msg+'\n')
+
+    session.close_connect()
+
+    if not orphans:
+        report.append('No "new_..." indexes found\n')
+    else:
+        report.append('Cleanup: %s freed, an index is no longer updated '
+                      'by %s row writes (since the statistics reset)\n' % (
+                          pretty_size(freed), writes))
+
+    return report
+
+
+def with_db(records, target):
+    """Add the target name to the records"""
+    name = target_name(target)
+    for r in records:
+        r['db'] = name
+        yield r
+
+
+def get_bloat(idx_stat):
+    """Get bloat records by the selected estimator"""
+    if ESTIMATOR == 'catalog':
+        return idx_stat.iter_bloat()
+
+    return idx_stat.get_bloat_stat(ESTIMATOR, ESTIMATOR_TIME_BUDGET)
+
+
+def save_snapshot(idx_stat, target, bloat):
+    """Save a snapshot of size, bloat and scans of all indexes
+    of the target to the history store
+    """
+    bloat = dict(((r['schema'], r['index']), r['bloat']) for r in bloat)
+    history.add_snapshot(target_name(target),
+                         [(r['schema'], r['index'], r['size'],
+                           bloat.get((r['schema'], r['index']), 0),
+                           r['scans'])
+                          for r in idx_stat.iter_indexes()])
+
+
+def get_growth(trends):
+    """Get indexes which bloat grows ordered by days left
+    until the bloat ratio reaches auto_min_ratio
+    """
+    growth = []
+    for (schema, iname), t in trends.items():
+        if t['bloat_rate'] <= 0:
+            continue
+
+        growth.append({'index': db.join_name(schema, iname),
+                       'size': t['size'],
+                       'ratio': t['ratio'], 'bloat_rate': t['bloat_rate'],
+                       'days_left': days_to_threshold(t['ratio'],
+                                                      t['ratio_rate'],
+                                                      AUTO_MIN_RATIO)})
+
+    growth.sort(key=lambda r: (r['days_left'] is None,
+                               r['days_left'] or 0))
+    return growth
+
+
+def with_trend(records, trends):
+    """Add the bloat growth rate and days left until the bloat ratio
+    reaches auto_min_ratio to the bloat records
+    """
+    for r in records:
+        t = trends.get((r['schema'], r['index']))
+        r['bloat_rate'] = None
+        r['days_left'] = None
+        if t:
+            r['bloat_rate'] = t['bloat_rate']
+            r['days_left'] = days_to_threshold(r['ratio'], t['ratio_rate'],
+                                               AUTO_MIN_RATIO)
+        yield r
+
+
+def recent_unused(idx_stat, trends):
+    """Yield indexes scanned at most args.scan_counter times during
+    the trend window. Indexes without snapshots are filtered
+    by the counters since the statistics reset
+    """
+    for r in idx_stat.iter_unused(MAX_SCAN_COUNTER):
+        t = trends.get((r['schema'], r['index']))
+        r['recent_scans'] = t['scans'] if t else r['scans']
+        r['scans_per_day'] = t['scans_per_day'] if t else None
+        if r['recent_scans'] is not None and \
+                r['recent_scans'] <= args.scan_counter:
+            yield r
+
+
+def show_stat(target, writer=None):
+    """Print the requested index statistics of the target
+    as a table or by the writer (see RecordWriter)
+    """
+    session = make_session(target)
+    idx_stat = db.GlobIndexStat(target['dbname'])
+    #idx_stat.set_log(log)
+    if not idx_stat.set_session(session):
+        return False
+
+    # Save a snapshot and get changes since the previous ones:
+    bloat = None
+    trends = None
+    if history and (args.stat or args.scan_counter is not None):
+        bloat = list(get_bloat(idx_stat) if args.stat
+                     else idx_stat.iter_bloat())
+        save_snapshot(idx_stat, target, bloat)
+        trends = history.get_trends(target_name(target), TREND_WINDOW)
+
+    if writer:
+        if args.stat:
+            records = bloat if bloat is not None else get_bloat(idx_stat)
+            columns = ['db'] + idx_stat.BLOAT_COLUMNS
+            if trends is not None:
+                records = with_trend(records, trends)
+                columns += idx_stat.TREND_COLUMNS
+            writer.write(with_db(records, target), columns)
+
+        if args.invalid:
+            writer.write(with_db(idx_stat.iter_invalid(), target),
+                         ['db'] + idx_stat.NAME_COLUMNS)
+
+        if args.scan_counter is not None:
+            if trends is not None:
+                writer.write(with_db(recent_unused(idx_stat, trends),
+                                     target),
+                             ['db'] + idx_stat.UNUSED_COLUMNS +
+                             idx_stat.RECENT_COLUMNS)
+            else:
+                writer.write(with_db(idx_stat.iter_unused(args.scan_counter),
+                                     target),
+                             ['db'] + idx_stat.UNUSED_COLUMNS)
+
+        if args.new:
+            writer.write(with_db(idx_stat.iter_with_pref('new_'), target),
+                         ['db'] + idx_stat.NAME_COLUMNS)
+
+        if args.redundant:
+            writer.write(with_db(find_redundant(idx_stat.iter_index_defs()),
+                                 target), ['db'] + REDUNDANT_COLUMNS)
+
+    else:
         # Show top of bloated indexes:
         if args.stat:
-            idx_stat.print_bloat_top()
+            if ESTIMATOR == 'catalog':
+                idx_stat.print_bloat_top()
+            else:
+                idx_stat.print_bloat_records(
+                    bloat if bloat is not None else get_bloat(idx_stat))
+
+            if trends is not None:
+                print()
+                idx_stat.print_bloat_growth(get_growth(trends),
+                                            TREND_WINDOW)
 
         # Show invalid indexes:
         if args.invalid:
@@ -165,12 +1235,124 @@ def main():
 
         # Show unused indexes:
         if args.scan_counter is not None:
-            idx_stat.print_unused(args.scan_counter)
+            if trends is not None:
+                idx_stat.print_unused_records(recent_unused(idx_stat,
+                                                            trends))
+            else:
+                idx_stat.print_unused(args.scan_counter)
 
         if args.new:
             idx_stat.show_idx_with_pref('new_')
 
-        idx_stat.close_connect()
+        # Show duplicate and redundant indexes:
+        if args.redundant:
+            print_findings(find_redundant(idx_stat.iter_index_defs()))
+
+    idx_stat.close_connect()
+    session.close_connect()
+    return True
+
+
+def show_stat_async(targets):
+    """Print the requested index statistics of all the targets
+    collected at the same time as one report
+    """
+    # psycopg 3 is required for this mode only:
+    import lib.async_stat as async_stat
+
+    dsns = [(target_name(t), db.make_dsn(t['dbname'], t['con_type'],
+                                         t['host'], t['port'],
+                                         DB_USER, DB_PASSWD))
+            for t in targets]
+
+    writer = None
+    if args.output != 'table':
+        writer = RecordWriter(args.output)
+
+    def show(records, columns, print_table):
+        if writer:
+            writer.write(records, columns)
+        else:
+            print_table(records)
+
+    if args.stat:
+        show(async_stat.survey_bloat(dsns, args.async_jobs),
+             ['db'] + db.GlobIndexStat.BLOAT_COLUMNS,
+             async_stat.print_bloat_top)
+
+    if args.invalid:
+        show(async_stat.survey_invalid(dsns, args.async_jobs),
+             ['db'] + db.GlobIndexStat.NAME_COLUMNS,
+             lambda r: async_stat.print_names(r, 'Invalid indexes found:',
+                                              'No invalid indexes found'))
+
+    if args.scan_counter is not None:
+        show(async_stat.survey_unused(dsns, args.scan_counter,
+                                      concurrency=args.async_jobs),
+             ['db'] + db.GlobIndexStat.UNUSED_COLUMNS,
+             async_stat.print_unused)
+
+    if args.new:
+        show(async_stat.survey_with_pref(dsns, 'new_', args.async_jobs),
+             ['db'] + db.GlobIndexStat.NAME_COLUMNS,
+             lambda r: async_stat.print_names(r, '"new_..." indexes found:',
+                                              'No "new_..." indexes found'))
+
+
+def serve_metrics(targets):
+    """Serve metrics of all the targets until interrupted"""
+    from lib.metrics import MetricsExporter, collect_index_metrics
+
+    # One session per target is kept for all collections:
+    sessions = [(target_name(t), make_session(t)) for t in targets]
+    exporter = MetricsExporter(
+        lambda: collect_index_metrics(sessions, history), METRICS_INTERVAL)
+    exporter.serve_forever(METRICS_PORT, METRICS_ADDR)
+
+    for name, session in sessions:
+        session.close_connect()
+
+
+def main():
+    global journal
+
+    targets = get_targets()
+    if not targets:
+        print('No databases to process')
+        sys.exit(1)
+
+    multi = len(targets) > 1
+
+    if args.serve_metrics:
+        serve_metrics(targets)
+        if history:
+            history.close()
+        sys.exit(0)
+
+    #
+    # If stat argument is passed:
+    #
+    if (args.stat or args.invalid or
+        args.scan_counter or args.new or args.redundant):
+        # The redundancy analysis is done table by table
+        # on one connection:
+        if args.use_async and not args.redundant:
+            show_stat_async(targets)
+            sys.exit(0)
+
+        writer = None
+        if args.output != 'table':
+            writer = RecordWriter(args.output)
+
+        # The statistics are printed directly,
+        # so the targets are processed one by one:
+        for target in targets:
+            if multi and not writer:
+                print('\n%s\n%s' % (target_name(target),
+                                    '=' * len(target_name(target))))
+            if not show_stat(target, writer) and not multi:
+                sys.exit(1)
+
         sys.exit(0)
 
     #
@@ -181,7 +1363,7 @@ def main():
     mail_report = Mail(ALLOW_MAIL_NOTIFICATION, SMTP_SRV, SMTP_PORT,
                        SMTP_ACC, SMTP_PASS, SENDER, RECIPIENT, SBJ)
 
-    if args.index or args.filename:
+    if args.index or args.filename or args.auto_rebuild or args.cleanup:
         # Set up the logging configuration:
         log_fname = '%s/%s-%s' % (LOG_DIR, LOG_PREF, TODAY)
         row_format = '%(asctime)s [%(levelname)s] %(message)s'
@@ -192,26 +1374,7 @@ def main():
         print('Log will be collected into %s' % log_fname)
 
     if args.index:
-        index = db.Index(args.index, args.dbname)
-        index.set_log(log)
-        if args.verbose:
-            index.set_verbosity(True)
-
-        if index.get_connect(con_type=DB_CONTYPE, host=DB_HOST,
-                             pg_port=DB_PORT, user=DB_USER,
-                             passwd=DB_PASSWD):
-            index.set_lock_query_timeo(LOCK_QUERY_TIMEO)
-            stat = index.rebuild()
-            index.close_connect()
-            if stat:
-                report_list.append(stat+'\n')
-            else:
-                report_list.append('Rebuilding %s failed. '
-                                   'See %s for more info\n' %
-                                   (args.index, log_fname))
-        else:
-            report_list.append('Connection to the database '
-                               '%s failed\n' % args.dbname)
+        indexnames = [args.index]
 
     # Rebuild indexes by using index names from the passed file:
     elif args.filename:
@@ -221,40 +1384,72 @@ def main():
             print(e)
             sys.exit(e.errno)
 
+        indexnames = []
         for i in fp:
             if i == '\n':
                 continue
 
-            indexname = i.rstrip('\n').strip(' ')
-
-            index = db.Index(indexname, args.dbname)
-            index.set_log(log)
-            if args.verbose:
-                index.set_verbosity(True)
-
-            if index.get_connect(con_type=DB_CONTYPE, host=DB_HOST,
-                                 pg_port=DB_PORT, user=DB_USER,
-                                 passwd=DB_PASSWD):
-                index.set_lock_query_timeo(LOCK_QUERY_TIMEO)
-                stat = index.rebuild()
-                index.close_connect()
-                if stat:
-                    report_list.append(stat+'\n')
-                else:
-                    report_list.append('Rebuilding %s failed. '
-                                       'See %s for more info\n' %
-                                       (args.index, log_fname))
-            else:
-                report_list.append('Connection to the database '
-                                   '%s failed\n' % args.dbname)
-                break
+            indexnames.append(i.rstrip('\n').strip(' '))
+
+        fp.close()
+
+    if args.index or args.filename or args.auto_rebuild or args.cleanup:
+        # The cleanup doesn't start a new batch of the journal,
+        # it checks the rebuilds of the last one:
+        if JOURNAL_FILE:
+            try:
+                journal = RebuildJournal(JOURNAL_FILE)
+            except IOError as e:
+                print('Cannot open journal_file %s: %s' % (JOURNAL_FILE,
+                                                          e.strerror))
+                sys.exit(e.errno)
+            if not args.resume and not args.cleanup:
+                journal.start_batch()
+        elif args.resume and not JOURNAL_FILE:
+            print('The --resume arg requires journal_file '
+                  'in the configuration file')
+            sys.exit(1)
 
+        def process(target):
+            if args.cleanup:
+                return cleanup(target, log, log_fname)
+
+            # Rebuild indexes selected by the bloat estimate:
+            if args.auto_rebuild:
+                return auto_rebuild(target, log, log_fname)
+
+            return rebuild_indexes(target, indexnames, log, log_fname)
+
+        # Databases are processed concurrently,
+        # at most args.host_jobs databases of one host at the same time:
+        fanout = FanOutScheduler(args.host_jobs)
+        results = fanout.run([(t, (t['host'], t['port'])) for t in targets],
+                             process)
+
+        # Combined report:
+        for target, report in zip(targets, results):
+            if report is None:
+                report = ['Processing of %s failed. See %s '
+                          'for more info\n' % (target_name(target),
+                                               log_fname)]
+            for line in report:
+                if multi:
+                    line = '%s: %s' % (target_name(target), line)
+                report_list.append(line)
+
+    if args.filename or args.auto_rebuild or args.cleanup or multi:
         x = 1
         print("\nSummary:\n========")
         for i in report_list:
             print('[%s] %s' % (x, i), end='')
             x += 1
 
+    if history:
+        history.close()
+
+    if journal:
+        journal.close()
+
     mail_message = ''.join(report_list)
     mail_report.send(mail_message)
 
@@ -0,0 +1,164 @@
+# async_stat - The asynchronous collector of index statistics
+# of many databases
+# Date: 17-10-2026
+
+import asyncio
+import sys
+
+try:
+    import psycopg
+    assert psycopg
+except ImportError as e:
+    print(e, "Hint: use pip3 install 'psycopg[binary]'")
+    sys.exit(1)
+
+from lib.common import pretty_size
+from lib.database import sql_templates
+
+# Max number of databases queried at the same time:
+DEFAULT_CONCURRENCY = 20
+
+
+async def _fetch(name, dsn, query, params, sem):
+    async with sem:
+        try:
+            conn = await psycopg.AsyncConnection.connect(dsn,
+                                                         autocommit=True)
+        except psycopg.Error as e:
+            return name, e
+
+        try:
+            cur = await conn.execute(query, params)
+            return name, await cur.fetchall()
+        except psycopg.Error as e:
+            return name, e
+        finally:
+            await conn.close()
+
+
+async def _collect(targets, query, params, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[_fetch(name, dsn, query, params, sem)
+                                  for name, dsn in targets])
+
+
+def collect(targets, query, concurrency=DEFAULT_CONCURRENCY, params=None):
+    """Run the query against all the targets at the same time.
+    targets - list of (database name, connection string) pairs,
+    params - values of the query placeholders (bound by the server).
+    Returns a list of (database name, rows) pairs
+    where rows are replaced by an exception if the query failed
+    """
+    return asyncio.run(_collect(targets, query, params, concurrency))
+
+
+def _merge(results, make_record):
+    """Make one list of records of all databases,
+    failures are printed
+    """
+    records = []
+    for name, rows in results:
+        if isinstance(rows, Exception):
+            print('%s: %s' % (name, str(rows).strip()))
+            continue
+
+        for row in rows:
+            records.append(make_record(name, row))
+
+    return records
+
+
+def survey_bloat(targets, concurrency=DEFAULT_CONCURRENCY):
+    """Get the bloat estimate of indexes of all the targets
+    ordered by bloat size
+    """
+    results = collect(targets, sql_templates['IDX_BLOAT_RAW_SQL'],
+                      concurrency)
+    records = _merge(results, lambda name, s: {'db': name,
+                                               'schema': s[0],
+                                               'table': s[1],
+                                               'index': s[2],
+                                               'size': int(s[3]),
+                                               'bloat': int(s[4]),
+                                               'ratio': float(s[5]),
+                                               'confidence': 'low'})
+    records.sort(key=lambda r: r['bloat'], reverse=True)
+    return records
+
+
+def survey_unused(targets, scan_counter=0, size_threshold=0,
+                  concurrency=DEFAULT_CONCURRENCY):
+    """Get unused indexes of all the targets ordered by size"""
+    results = collect(targets, sql_templates['IDX_SCAN_RAW_SQL'],
+                      concurrency, params=(scan_counter, size_threshold))
+    records = _merge(results, lambda name, s: {'db': name,
+                                               'index': s[0],
+                                               'size': int(s[1]),
+                                               'scans': s[2],
+                                               'table': s[3],
+                                               'schema': s[4]})
+    records.sort(key=lambda r: r['size'], reverse=True)
+    return records
+
+
+def survey_invalid(targets, concurrency=DEFAULT_CONCURRENCY):
+    """Get invalid indexes of all the targets"""
+    results = collect(targets, sql_templates['GET_INVALID_IDX'],
+                      concurrency)
+    records = _merge(results, lambda name, s: {'db': name, 'index': s[0]})
+    records.sort(key=lambda r: (r['db'], r['index']))
+    return records
+
+
+def survey_with_pref(targets, pref, concurrency=DEFAULT_CONCURRENCY):
+    """Get indexes with 'pref' prefix of all the targets"""
+    results = collect(targets, sql_templates['IDX_WITH_PREF'],
+                      concurrency, params=(pref, pref))
+    records = _merge(results, lambda name, s: {'db': name, 'index': s[0]})
+    records.sort(key=lambda r: (r['db'], r['index']))
+    return records
+
+
+def print_bloat_top(records, limit=50):
+    """Print top of bloated indexes of all databases"""
+    if not records:
+        print('No bloated indexes found')
+        return
+
+    print('{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}'
+          .format('n', '^', '4', '| db', '<', '32', '| tname', '<', '40',
+                  '| iname', '<', '48', '|     size', '<', '11',
+                  '| bloat', '<', '11', '| ratio', '<', 8))
+    print('-' * 154)
+
+    for n, r in enumerate(records[:limit], 1):
+        print('{:{}{}} | {:{}{}} | {:{}{}} | {:{}{}} | '
+              '{:{}{}} | {:{}{}} | {:{}{}}'
+              .format(n, '>', '3', r['db'], '<', '29', r['table'], '<', '37',
+                      r['index'], '<', '45', pretty_size(r['size']), '<', '8',
+                      pretty_size(r['bloat']), '<', '8', r['ratio'], '<', '8'))
+
+
+def print_unused(records):
+    """Print unused indexes of all databases"""
+    print(' n   {:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}'
+          .format('| db', '<', '32', '| iname', '<', '66', '| size', '<',
+                  '10', '| usage', '<', '8', '| tname', '<', '42'))
+    print('-' * 152)
+
+    for n, r in enumerate(records):
+        print('{:{}{}} | {:{}{}}| {:{}{}}| {:{}{}}| {:{}{}}| {:{}{}}'
+              .format(n, '>', '4', r['db'], '<', '30', r['index'], '<', '64',
+                      pretty_size(r['size']), '<', '8', r['scans'], '<', '6',
+                      r['table'], '<', '42'))
+
+
+def print_names(records, title, empty):
+    """Print database and index names"""
+    if records:
+        print(title)
+        print('=' * len(title))
+        for r in records:
+            print('%s: %s' % (r['db'], r['index']))
+    else:
+        print(empty)
@@ -1,9 +1,78 @@
+import csv
+import json
 import smtplib
 import sys
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 
+SIZE_UNITS = {'': 1,
+              'B': 1,
+              'KB': 1024,
+              'MB': 1024 ** 2,
+              'GB': 1024 ** 3,
+              'TB': 1024 ** 4}
+
+
+def parse_size(size):
+    """Convert a size like "512MB" or "10GB" (PostgreSQL style units)
+    or a number of bytes to a number of bytes
+    """
+    if isinstance(size, int):
+        return size
+
+    value = str(size).strip().upper()
+    num = value.rstrip('KMGTB ')
+    unit = value[len(num):].strip()
+
+    if not num.isdigit() or unit not in SIZE_UNITS:
+        err = 'parse_size(): unrecognized size "%s"' % size
+        raise ValueError(err)
+
+    return int(num) * SIZE_UNITS[unit]
+
+
+def pretty_size(size):
+    """Format a number of bytes like pg_size_pretty() does"""
+    for unit in ('bytes', 'kB', 'MB', 'GB'):
+        if abs(size) < 10 * 1024:
+            return '%d %s' % (size, unit)
+        size = round(size / 1024.0)
+
+    return '%d TB' % size
+
+
+class RecordWriter():
+    """Class for writing records (dictionaries) as JSON Lines or CSV.
+    The CSV header is written once for each set of columns
+    """
+    def __init__(self, fmt, out=sys.stdout):
+        if fmt not in ('json', 'csv'):
+            err = "RecordWriter(): format must be "
+            err += "'json' or 'csv', passed '%s'" % fmt
+            raise ValueError(err)
+
+        self.fmt = fmt
+        self.out = out
+        self.__columns = None
+
+    def write(self, records, columns):
+        """Write the records (any iterable) one by one"""
+        if self.fmt == 'json':
+            for r in records:
+                self.out.write(json.dumps(r, default=str) + '\n')
+            return
+
+        writer = csv.DictWriter(self.out, fieldnames=columns,
+                                extrasaction='ignore')
+        if columns != self.__columns:
+            writer.writeheader()
+            self.__columns = columns
+
+        for r in records:
+            writer.writerow(r)
+
+
 class ConfParser():
     """Class for parsing a passed configuration file,
     returns a dictionary{param: value}
@@ -4,10 +4,16 @@
 
 import datetime
 import logging
+import random
+import re
 import sys
+import threading
+import time
+import weakref
 
 try:
     import psycopg2
+    from psycopg2 import sql
     assert psycopg2
 except ImportError as e:
     print(e, "Hint: use pip3 install psycopg2-binary")
@@ -20,6 +26,11 @@ except ImportError as e:
     print(e, "Hint: use pip3 install pyyaml")
     sys.exit(1)
 
+from lib.common import pretty_size
+from lib.indexdef import IndexDef, join_name, quote_ident, split_name
+from lib.journal import RebuildJournal
+from lib.planner import tune_build
+
 __version__ = '1.2.3'
 
 INF = 0
@@ -28,6 +39,16 @@ WRN = 2
 DEB = 3
 CRT = 4
 
+# Error codes of failed lock attempts
+# (lock_not_available, query_canceled):
+LOCK_ERRCODES = ('55P03', '57014')
+
+# Number of rows fetched by a server-side cursor at once:
+FETCH_BATCH = 1000
+
+# Bloat estimators (see GlobIndexStat.get_bloat_stat()):
+ESTIMATORS = ('catalog', 'pgstattuple', 'auto')
+
 # Max length of a database object name:
 MAX_NAME_LEN = 63
 
@@ -35,6 +56,69 @@ MAX_NAME_LEN = 63
 SQL_FILE = './lib/database_sql.yml'
 sql_templates = load(open(SQL_FILE, 'r'))
 
+# Names of statements prepared by every connection
+# (see _DatBase.do_prepared()):
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+# Connections that can't keep prepared statements:
+_unprepared = weakref.WeakSet()
+
+# Errors of PREPARE / EXECUTE when the connection of a transaction
+# pooler gets another server connection for the next transaction
+# (duplicate_prepared_statement, invalid_sql_statement_name):
+POOLER_ERRCODES = ('42P05', '26000')
+
+
+def ident(name):
+    """Get the [schema.]name (see split_name()) as sql.Identifier"""
+    return sql.Identifier(*[p for p in split_name(name) if p is not None])
+
+
+def plain_query(name, params=()):
+    """Get the query of sql_templates with $1, $2... as (query, params)
+    for the plain execution with named psycopg2 placeholders
+    """
+    if not params:
+        return sql_templates[name], None
+
+    query = sql_templates[name].replace('%', '%%')
+    return re.sub(r'\$(\d+)', r'%(p\1)s', query), \
+        dict(('p%s' % (n + 1), p) for n, p in enumerate(params))
+
+
+def parse_version(version):
+    """Get (major, minor) tuple from SELECT version() output,
+    e.g. 'PostgreSQL 12.3 on x86_64-pc-linux-gnu...' -> (12, 3)
+    """
+    m = re.match(r'PostgreSQL (\d+)(?:\.(\d+))?', version)
+    if not m:
+        return (0,)
+
+    return (int(m.group(1)), int(m.group(2) or 0))
+
+
+def make_dsn(dbname, con_type='u_socket', host='', pg_port='5432',
+             user='postgres', passwd=''):
+    """Make a connection string for the database"""
+    if con_type == 'u_socket':
+        if user == 'postgres':
+            params = 'dbname=%s user=postgres' % (dbname)
+
+        else:
+            params = 'dbname=%s user=%s '\
+                     'password=%s' % (dbname, user, passwd)
+    elif con_type == 'network':
+        params = 'host=%s port=%s dbname=%s '\
+                 'user=%s password=%s' % (host, pg_port,
+                                          dbname, user, passwd)
+    else:
+        err = 'make_dsn(): '\
+              'con_type must be "u_socket" or "network"'
+        raise TypeError(err)
+        sys.exit(1)
+
+    return params
+
 
 class _DatBase(object):
     """Base class of database objects that
@@ -44,8 +128,18 @@ class _DatBase(object):
         self.set_name(name)
         self.set_dbname(dbname)
         self.log = None
-        self.lock_query_timeout = '0'
+        self.lock_query_timeo = '0'
+        self.lock_strategy = {'retries': 1,
+                              'delay': 1,
+                              'max_delay': 60,
+                              'deadline': 0,
+                              'cancel_after': 0}
+        self.last_error = None
         self.verbosity = False
+        self.session = None
+        self.use_prepared = True
+        # (major, minor) got from SELECT version() on connect:
+        self.server_version = (0,)
 
     def logger(self, msg, lvl=INF):
         if self.log:
@@ -96,24 +190,58 @@ class _DatBase(object):
         self.dbname = dbname
 
     def __check_name(self, name):
+        """Check the name that may be passed as [schema.]name
+        (see split_name()), any characters are allowed
+        as queries get names as parameters or quoted identifiers
+        """
+        try:
+            parts = split_name(name)
+        except ValueError as e:
+            return '_DatBase.set_name: %s' % e
+
         err = ''
-        if len(name) > MAX_NAME_LEN:
-            err = '_DatBase.set_name: passed name "%s" '\
-                  'is too long (>%s chars)' % (name, MAX_NAME_LEN)
-        elif name.isdigit():
-            err = '_DatBase.set_name: passed name "%s" '\
-                  'contents digits only' % name
-
-        for c in name:
-            if not c.isalpha() and not c.isdigit() and c != '_':
+        for part in parts:
+            if part and len(part.encode('utf-8')) > MAX_NAME_LEN:
+                err = '_DatBase.set_name: passed name "%s" '\
+                      'is too long (>%s bytes)' % (name, MAX_NAME_LEN)
+            elif part and '\x00' in part:
                 err = '_DatBase.set_name: passed name "%s" '\
-                      'contents not alphabetical, '\
-                      'not numeric or not "_"  symbols' % name
+                      'contents the NUL character' % name
         return err
 
+    def set_prepared(self, boolean):
+        """Use prepared statements for catalog queries
+        (see do_prepared())
+        """
+        if not isinstance(boolean, bool):
+            raise TypeError('_DatBase.set_prepared(): '
+                            'expects boolean argument')
+
+        self.use_prepared = boolean
+
     def set_lock_query_timeo(self, timeo):
         self.lock_query_timeo = timeo
 
+    def set_lock_strategy(self, retries=1, delay=1, max_delay=60,
+                          deadline=0, cancel_after=0):
+        """Set up retries of lock acquisition (see retry_on_lock()):
+        retries - max number of attempts,
+        delay, max_delay - initial and max delay between attempts (sec),
+        deadline - total time limit of all attempts (sec, 0 - no limit),
+        cancel_after - cancel queries that block the table
+        and run longer than that (sec, 0 - never)
+        """
+        if retries < 1:
+            err = '_DatBase.set_lock_strategy(): '\
+                  'retries must be a positive integer'
+            raise ValueError(err)
+
+        self.lock_strategy = {'retries': retries,
+                              'delay': delay,
+                              'max_delay': max_delay,
+                              'deadline': deadline,
+                              'cancel_after': cancel_after}
+
     def set_log(self, log):
         if isinstance(log, logging.Logger):
             self.log = log
@@ -136,28 +264,15 @@ class _DatBase(object):
         #    print("Error, attribute 'DatBase.log' is not defined")
         #    sys.exit(1)
 
-        if con_type == 'u_socket':
-            if user == 'postgres':
-                params = 'dbname=%s user=postgres' % (self.dbname)
-
-            else:
-                params = 'dbname=%s user=%s '\
-                         'password=%s' % (self.dbname, user, passwd)
-        elif con_type == 'network':
-            params = 'host=%s port=%s dbname=%s '\
-                     'user=%s password=%s' % (host, pg_port,
-                                              self.dbname, user, passwd)
-        else:
-            err = '_DatBase.get_connect(): '\
-                  'con_type must be "u_socket" or "network"'
-            raise TypeError(err)
-            sys.exit(1)
+        params = make_dsn(self.dbname, con_type, host, pg_port,
+                          user, passwd)
 
         try:
             self.connect = psycopg2.connect(params)
             self.connect.set_session(autocommit=auto_commit)
             self.cursor = self.connect.cursor()
             self.do_query('SELECT version();', err_exit=True)
+            self.server_version = parse_version(self.cursor.fetchone()[0])
             self.logger('Connection to database %s established'
                         % self.dbname)
             return self.connect
@@ -166,18 +281,89 @@ class _DatBase(object):
             self.logger(e, ERR)
             return False
 
-    def do_query(self, query, err_exit=False):
+    def set_session(self, session):
+        """Use the shared connection of the session
+        instead of opening an own one
+        """
+        if not isinstance(session, Session):
+            err = "_DatBase.set_session() requires "\
+                  "an argument as an object of the Session class, "\
+                  "passed %s" % type(session)
+            raise TypeError(err)
+
+        connect = session.acquire()
+        if not connect:
+            return False
+
+        self.session = session
+        self.connect = connect
+        self.cursor = self.connect.cursor()
+        self.server_version = session.server_version
+        self.use_prepared = session.use_prepared
+        return self.connect
+
+    def do_query(self, query, err_exit=False, params=None):
         try:
-            return self.cursor.execute(query)
+            return self.cursor.execute(query, params)
         except psycopg2.DatabaseError as e:
             self.logger(e, ERR)
             if err_exit:
                 sys.exit(1)
             return False
 
-    def do_service_query(self, query, err_exit=False):
+    def do_prepared(self, name, params=()):
+        """Execute the query of sql_templates by its name
+        as a prepared statement binding params to its $1, $2...
+        The statement is prepared once by every connection,
+        so repeated catalog lookups of a batch are planned once.
+        If statements are lost between transactions (a transaction
+        pooler like pgbouncer in transaction mode) or prepared
+        statements are disabled (see set_prepared()), the query
+        is executed as a plain one. Returns False on error as do_query()
+        """
+        if not self.use_prepared or self.connect in _unprepared:
+            query, params = plain_query(name, params)
+            return self.do_query(query, params=params)
+
+        with _prepared_lock:
+            prepared = _prepared.setdefault(self.connect, set())
+
+        stmt = sql.Identifier(name.lower())
+        if not params:
+            execute = sql.SQL('EXECUTE {}').format(stmt)
+        else:
+            execute = sql.SQL('EXECUTE {} ({})').format(
+                stmt, sql.SQL(', ').join(sql.Placeholder() * len(params)))
+
         try:
-            if self.cursor.execute(query) is None:
+            if name not in prepared:
+                self.cursor.execute(sql.SQL('PREPARE {} AS ').format(stmt) +
+                                    sql.SQL(sql_templates[name]))
+                prepared.add(name)
+
+            return self.cursor.execute(execute, params or None)
+        except psycopg2.DatabaseError as e:
+            if e.pgcode not in POOLER_ERRCODES:
+                self.logger(e, ERR)
+                return False
+
+        self.logger('Prepared statements are lost between transactions '
+                    '(transaction pooling?), catalog queries are executed '
+                    'without them', WRN)
+        _unprepared.add(self.connect)
+        query, params = plain_query(name, params)
+        return self.do_query(query, params=params)
+
+    def as_string(self, query):
+        """Get the query composed by psycopg2.sql as text for logging"""
+        if isinstance(query, sql.Composable):
+            return query.as_string(self.connect)
+
+        return query
+
+    def do_service_query(self, query, err_exit=False, params=None):
+        try:
+            if self.cursor.execute(query, params) is None:
                 return True
             else:
                 return False
@@ -187,18 +373,294 @@ class _DatBase(object):
         except psycopg2.DatabaseError as e:
             print(e)
             self.logger(e, ERR)
+            self.last_error = e
             return False
 
+    def get_backend_pid(self):
+        self.do_query('SELECT pg_backend_pid()')
+        return self.cursor.fetchone()[0]
+
     def set_statement_timeout(self, timeout):
-        return self.do_service_query("SET statement_timeout = '%s'" % timeout)
+        return self.do_service_query('SET statement_timeout = %s',
+                                     params=(str(timeout),))
+
+    def set_lock_timeout(self, timeout):
+        return self.do_service_query('SET lock_timeout = %s',
+                                     params=(str(timeout),))
+
+    def cancel_blockers(self, table, older_than):
+        """Cancel queries of transactions that hold locks on the table
+        and have been started more than older_than seconds ago
+        """
+        self.do_query(sql_templates['CANCEL_BLOCKERS_SQL'],
+                      params=(table, older_than))
+        for row in self.cursor.fetchall():
+            self.logger('Query of backend %s blocking %s '
+                        'is canceled' % (row[0], table), WRN)
+
+    def retry_on_lock(self, attempt, table=''):
+        """Call attempt() that must return True on success
+        under lock_timeout equal to lock_query_timeo.
+        If it fails because of the lock timeout, repeat it after
+        an exponentially growing delay with jitter according
+        to the lock strategy (see set_lock_strategy()).
+        Queries never wait for a lock longer than lock_query_timeo,
+        so they don't make application queries wait behind them
+        """
+        st = self.lock_strategy
+        start = time.time()
+        delay = st['delay']
+        done = False
+
+        for n in range(1, st['retries'] + 1):
+            if self.set_lock_timeout(self.lock_query_timeo):
+                self.logger("Set lock timeout '%s': success" %
+                            self.lock_query_timeo)
+            else:
+                self.logger("Set lock timeout '%s': failure" %
+                            self.lock_query_timeo, ERR)
+
+            self.last_error = None
+            done = attempt()
+            if done:
+                break
+
+            if (self.last_error is None or
+                    self.last_error.pgcode not in LOCK_ERRCODES):
+                break
+
+            if n == st['retries']:
+                self.logger('Lock is not acquired, '
+                            '%s attempts are exhausted' % n, WRN)
+                break
+
+            # Full delay with +-50% jitter:
+            sleep = delay * random.uniform(0.5, 1.5)
+            if st['deadline'] and time.time() - start + sleep > st['deadline']:
+                self.logger('Lock is not acquired, '
+                            'deadline %ss is reached' % st['deadline'], WRN)
+                break
+
+            if st['cancel_after'] and table:
+                self.cancel_blockers(table, st['cancel_after'])
+
+            self.logger('Lock is not acquired (attempt %s), '
+                        'retry in %.1fs' % (n, sleep), WRN)
+            time.sleep(sleep)
+            delay = min(delay * 2, st['max_delay'])
+
+        if self.set_lock_timeout('0'):
+            self.logger("Reset lock timeout to '0': success")
+        else:
+            self.logger("Reset lock timeout to '0': failure", ERR)
+
+        return done
 
     def close_connect(self):
         try:
-            self.connect.close()
+            # The shared connection is closed by its session:
+            if self.session:
+                self.cursor.close()
+            else:
+                self.connect.close()
         except psycopg2.DatabaseError as e:
             self.logger(e, ERR)
 
 
+class Session(_DatBase):
+    """Class for sharing one database connection between
+    database objects (see _DatBase.set_session()).
+    The connection is opened once and is reopened
+    only if it has been lost
+    """
+    def __init__(self, dbname, con_type='u_socket', host='',
+                 pg_port='5432', user='postgres', passwd=''):
+        super().__init__('session', dbname)
+        self.con_params = {'con_type': con_type,
+                           'host': host,
+                           'pg_port': pg_port,
+                           'user': user,
+                           'passwd': passwd}
+        self.connect = None
+        self.cursor = None
+        # Progress monitor of builds done on the session:
+        self.monitor = None
+
+    def set_monitor(self, monitor):
+        """Keep the progress monitor (and its own session)
+        for all builds done on the session, it's closed
+        with the session
+        """
+        if not isinstance(monitor, ProgressMonitor):
+            err = "Session.set_monitor() requires "\
+                  "an argument as an object of the ProgressMonitor class, "\
+                  "passed %s" % type(monitor)
+            raise TypeError(err)
+
+        self.monitor = monitor
+
+    def is_alive(self):
+        """Check the connection by one short round trip
+        that also resets session settings which could be left
+        by a previous user of the session
+        """
+        if not self.connect or self.connect.closed:
+            return False
+
+        try:
+            if (self.connect.get_transaction_status() !=
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+                self.connect.rollback()
+
+            self.cursor.execute('RESET ALL')
+            return True
+        except psycopg2.Error as e:
+            self.logger(e, WRN)
+            return False
+
+    def acquire(self):
+        """Get the connection, reconnect if it has been lost"""
+        if self.is_alive():
+            return self.connect
+
+        if self.connect:
+            self.logger('Connection to database %s lost, '
+                        'reconnect' % self.dbname, WRN)
+            self.close_connect()
+
+        return self.get_connect(**self.con_params)
+
+    def close_connect(self):
+        if self.monitor:
+            self.monitor.close()
+
+        # The session may be never connected:
+        if self.connect:
+            super().close_connect()
+
+
+class ProgressMonitor(_DatBase):
+    """Class for reporting progress of an index build
+    from pg_stat_progress_create_index (PostgreSQL 12+).
+    The view is polled by a background thread on the passed session
+    that must differ from the session doing the build. One monitor
+    can be reused for builds done one after another (see
+    Session.set_monitor())
+    """
+    def __init__(self, session, interval=10):
+        super().__init__('progress', session.dbname)
+        self.monitor_session = session
+        self.interval = interval
+        # Functions called with the progress dictionary on every poll:
+        self.hooks = []
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def start(self, pid, iname):
+        """Start monitoring of the build done by the backend pid"""
+        if not self.set_session(self.monitor_session):
+            return False
+
+        if self.server_version < (12,):
+            self.logger('Progress reporting requires PostgreSQL 12+', WRN)
+            self.close_connect()
+            return False
+
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__poll,
+                                         args=(pid, iname),
+                                         name='progress-%s' % iname)
+        self.__thread.daemon = True
+        self.__thread.start()
+        return True
+
+    def stop(self):
+        if not self.__thread:
+            return
+
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        self.close_connect()
+
+    def close(self):
+        """Stop monitoring and close the monitor session"""
+        self.stop()
+        self.monitor_session.close_connect()
+
+    def __poll(self, pid, iname):
+        prev = None
+        stalled = 0
+
+        while not self.__stop.wait(self.interval):
+            # The build goes on without reporting,
+            # the session is reconnected by the next start():
+            if self.do_prepared('GET_IDX_PROGRESS_SQL', (pid,)) is False:
+                self.logger('%s: progress monitoring is stopped '
+                            'by the error above' % iname, WRN)
+                return
+
+            row = self.cursor.fetchone()
+            if not row:
+                continue
+
+            p = {'iname': iname,
+                 'phase': row[0],
+                 'blocks_total': row[1],
+                 'blocks_done': row[2],
+                 'tuples_total': row[3],
+                 'tuples_done': row[4],
+                 'block_size': row[5],
+                 'time': time.time()}
+
+            # Estimate rate and phase ETA by blocks if the phase
+            # processes blocks and by tuples otherwise:
+            if p['blocks_total']:
+                unit, done, total = 'blocks', p['blocks_done'], \
+                    p['blocks_total']
+            else:
+                unit, done, total = 'tuples', p['tuples_done'], \
+                    p['tuples_total']
+
+            rate = 0
+            if prev and prev['phase'] == p['phase']:
+                prev_done = prev[unit + '_done']
+                rate = (done - prev_done) / (p['time'] - prev['time'])
+                stalled = stalled + 1 if done == prev_done else 0
+
+            p['rate'] = rate
+            p['eta'] = (total - done) / rate if rate > 0 else None
+
+            msg = '%s: %s, blocks %s/%s, tuples %s/%s' % (
+                iname, p['phase'], p['blocks_done'], p['blocks_total'],
+                p['tuples_done'], p['tuples_total'])
+            if rate > 0:
+                if unit == 'blocks':
+                    msg += ', %.1f MB/s' % (rate * p['block_size'] /
+                                            1024 ** 2)
+                else:
+                    msg += ', %d tuples/s' % rate
+                msg += ', phase ETA %s' % datetime.timedelta(
+                    seconds=int(p['eta']))
+
+            if stalled:
+                msg += ', NO progress for %ss' % int(stalled * self.interval)
+                self.logger(msg, WRN)
+            else:
+                self.logger(msg)
+
+            if not self.verbosity:
+                print(msg)
+
+            for hook in self.hooks:
+                hook(p)
+
+            prev = p
+
+
 class DatBaseObject(_DatBase):
     """Class for managing databases as
     an database cluster object)
@@ -210,83 +672,498 @@ class DatBaseObject(_DatBase):
     # It may provide create/drop/alter
     # methods for example
 
+    def get_databases(self):
+        """Get a list of databases of the cluster
+        that allow connections (templates are excluded)
+        """
+        self.do_query(sql_templates['GET_DATABASES_SQL'])
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def get_replication_stat(self):
+        """Get the max replay lag of the streaming replicas
+        in seconds and in bytes and the current WAL position
+        (PostgreSQL 10+). Returns a dictionary or None on error
+        """
+        if self.do_query(sql_templates['GET_REPLICATION_STAT_SQL']) is False:
+            return None
+
+        row = self.cursor.fetchone()
+        return {'lag': float(row[0]),
+                'lag_bytes': int(row[1]),
+                'wal_pos': int(row[2]),
+                'time': time.time()}
+
+    def get_load_stat(self):
+        """Get load signals of the server (PostgreSQL 10+):
+        active client backends, backends waiting for locks,
+        blocks read and written, checkpoints (the last two are
+        cumulative counters). Returns a dictionary or None on error
+        """
+        # Checkpoints moved to pg_stat_checkpointer in PostgreSQL 17:
+        if self.server_version >= (17,):
+            query = sql_templates['GET_LOAD_STAT_17_SQL']
+        else:
+            query = sql_templates['GET_LOAD_STAT_SQL']
+
+        if self.do_query(query) is False:
+            return None
+
+        row = self.cursor.fetchone()
+        return {'active': int(row[0]),
+                'lock_waits': int(row[1]),
+                'blocks': int(row[2] or 0),
+                'block_size': int(row[3]),
+                'checkpoints': int(row[4]),
+                'time': time.time()}
+
+    def get_indexes_meta(self, inames, tmp_pref='new_'):
+        """Get metadata of all the passed indexes by one query,
+        names may be passed as [schema.]name (see split_name()).
+        Returns a dictionary {passed index name: metadata dictionary}
+        which items can be passed to Index.set_meta()
+        """
+        names = [split_name(i) for i in inames]
+        self.do_query(sql_templates['GET_IDX_META_SQL'],
+                      params=([n[0] for n in names], [n[1] for n in names],
+                              tmp_pref))
+
+        meta = {}
+        for row in self.cursor.fetchall():
+            meta[inames[row[14] - 1]] = {
+                'relkind': row[1],
+                'relsize': int(row[2]),
+                'valid': row[3],
+                'idef': row[4],
+                'icomment': row[5],
+                'itable': row[6],
+                'unique': row[7],
+                'tmp_exists': row[8],
+                'tmp_valid': row[9],
+                'amname': row[10],
+                # Attached to a partitioned index:
+                'attached': row[11],
+                # None - the default tablespace:
+                'tablespace': row[12],
+                'schema': row[13]}
+        return meta
+
+    def get_tablespaces(self):
+        """Get directories of tablespaces as a dictionary
+        {tablespace: path}, the data directory is readable
+        by superusers and pg_read_all_settings members only,
+        None on error
+        """
+        if self.do_query(sql_templates['GET_TABLESPACES_SQL']) is False:
+            return None
+
+        return dict(self.cursor.fetchall())
+
+    def get_default_tablespace(self):
+        """Get the default tablespace of the database"""
+        self.do_query(sql_templates['GET_DEFAULT_TABLESPACE_SQL'])
+        return self.cursor.fetchone()[0]
+
+    def get_temp_tablespace(self):
+        """Get the tablespace of sort temp files of this session
+        (the first of temp_tablespaces or the default one)
+        """
+        self.do_query(sql_templates['GET_TEMP_TABLESPACES_SQL'])
+        names = [t.strip().strip('"')
+                 for t in self.cursor.fetchone()[0].split(',')]
+        return names[0] if names[0] else self.get_default_tablespace()
+
+    def get_index_partitions(self, iname):
+        """Get indexes of all leaf partitions of the partitioned index
+        as a list of dictionaries, 'writes' are rows written
+        to the partition since the statistics reset,
+        'index' is qualified by the schema (see join_name()),
+        'relname' is its name in the schema
+        """
+        self.do_query(sql_templates['GET_IDX_PARTITIONS_SQL'],
+                      params=split_name(iname))
+
+        parts = []
+        for row in self.cursor.fetchall():
+            parts.append({'index': join_name(row[4], row[0]),
+                          'itable': row[1],
+                          'size': int(row[2]),
+                          'writes': int(row[3]),
+                          'schema': row[4],
+                          'relname': row[0],
+                          'amname': row[5]})
+        return parts
+
+    def get_orphans(self, pref='new_'):
+        """Get indexes with the 'pref' prefix left by interrupted
+        rebuilds with the state of their original indexes.
+        Returns a list of dictionaries which items can be passed
+        to Index.recover()
+        """
+        self.do_query(sql_templates['GET_ORPHAN_IDX_SQL'],
+                      params=(pref, pref, pref, pref))
+
+        orphans = []
+        for row in self.cursor.fetchall():
+            orphans.append({'tmp_name': row[0],
+                            'index': row[1],
+                            'tmp_valid': row[2],
+                            'tmp_size': int(row[3]),
+                            'orig_exists': row[4],
+                            'orig_valid': row[5],
+                            'orig_size': int(row[6]),
+                            'itable': row[7],
+                            # Rows written since the statistics reset,
+                            # the index is maintained for each of them:
+                            'writes': int(row[8]),
+                            'schema': row[9]})
+        return orphans
+
 
 class GlobIndexStat(_DatBase):
-    """Class for showing index statistics"""
+    """Class for showing index statistics.
+    The iter_*() methods are generators of records (dictionaries),
+    rows are fetched by a server-side cursor in batches,
+    so memory use doesn't depend on the number of indexes
+    """
+    # Columns of the records of the iter_*() methods:
+    BLOAT_COLUMNS = ['schema', 'table', 'index', 'size', 'bloat', 'ratio',
+                     'confidence']
+    UNUSED_COLUMNS = ['index', 'size', 'scans', 'table', 'schema']
+    INDEX_COLUMNS = ['schema', 'table', 'index', 'size', 'scans', 'valid']
+    # Columns added by the snapshot history (see RebuildHistory):
+    TREND_COLUMNS = ['bloat_rate', 'days_left']
+    RECENT_COLUMNS = ['recent_scans', 'scans_per_day']
+    NAME_COLUMNS = ['index']
+    IDX_DEF_COLUMNS = ['schema', 'table', 'index', 'relid', 'indkey',
+                       'indclass', 'indcollation', 'indoption', 'nkeyatts',
+                       'amname', 'unique', 'primary', 'exprs', 'pred',
+                       'size', 'scans', 'writes']
+
     def __init__(self, dbname):
         super().__init__('stat', dbname)
+        self.__cursor_num = 0
+
+    def iter_query(self, query, columns, batch=FETCH_BATCH, params=None):
+        """Yield rows of the query as dictionaries {column: value}"""
+        # Named cursors must be WITH HOLD in autocommit mode:
+        self.__cursor_num += 1
+        cursor = self.connect.cursor(name='idx_stat_%s' % self.__cursor_num,
+                                     withhold=True)
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield dict(zip(columns, row))
+        except psycopg2.DatabaseError as e:
+            print(e)
+            self.logger(e, ERR)
+        finally:
+            cursor.close()
+
+    def iter_bloat(self):
+        """Yield the bloat estimate of indexes with raw sizes (in bytes)
+        ordered by bloat size
+        """
+        for r in self.iter_query(sql_templates['IDX_BLOAT_RAW_SQL'],
+                                 self.BLOAT_COLUMNS):
+            r['size'] = int(r['size'])
+            r['bloat'] = int(r['bloat'])
+            r['ratio'] = float(r['ratio'])
+            # The catalog estimate relies on the planner statistics:
+            r['confidence'] = 'low'
+            yield r
+
+    def iter_unused(self, scan_counter=0, size_threshold=0):
+        """Yield unused indexes with raw sizes (in bytes)
+        ordered by size
+        """
+        for r in self.iter_query(sql_templates['IDX_SCAN_RAW_SQL'],
+                                 self.UNUSED_COLUMNS,
+                                 params=(scan_counter, size_threshold)):
+            r['size'] = int(r['size'])
+            yield r
+
+    def iter_indexes(self):
+        """Yield size (in bytes), scan counter and validity
+        of all user indexes
+        """
+        for r in self.iter_query(sql_templates['IDX_METRICS_SQL'],
+                                 self.INDEX_COLUMNS):
+            r['size'] = int(r['size'])
+            yield r
+
+    def iter_index_defs(self):
+        """Yield definitions of all valid user indexes
+        ordered by table (see the redundancy module).
+        Vectors of pg_index are parsed to tuples of integers
+        """
+        # Included columns appeared in PostgreSQL 11:
+        if self.server_version >= (11,):
+            nkeyatts = sql.SQL('i.indnkeyatts')
+        else:
+            nkeyatts = sql.SQL('i.indnatts')
+
+        query = sql.SQL(sql_templates['GET_IDX_DEFS_SQL']).format(nkeyatts)
+        for r in self.iter_query(query, self.IDX_DEF_COLUMNS):
+            for col in ('indkey', 'indclass', 'indcollation', 'indoption'):
+                r[col] = tuple(int(v) for v in r[col].split())
+            r['size'] = int(r['size'])
+            r['scans'] = int(r['scans'])
+            r['writes'] = int(r['writes'])
+            yield r
+
+    def iter_invalid(self):
+        """Yield invalid indexes"""
+        return self.iter_query(sql_templates['GET_INVALID_IDX'],
+                               self.NAME_COLUMNS)
+
+    def iter_with_pref(self, pref):
+        """Yield indexes with 'pref' prefix"""
+        return self.iter_query(sql_templates['IDX_WITH_PREF'],
+                               self.NAME_COLUMNS, params=(pref, pref))
 
     def show_idx_with_pref(self, pref):
         """Print indexes with 'pref' prefix"""
-        self.do_query(sql_templates['IDX_WITH_PREF'] % pref)
-        idxs = self.cursor.fetchall()
-
-        if idxs:
-            print('"%s..." indexes found:' % pref)
-            print('=' * 22)
-            for s in idxs:
-                print('%s' % s[0])
-        else:
+        found = False
+        for r in self.iter_with_pref(pref):
+            if not found:
+                print('"%s..." indexes found:' % pref)
+                print('=' * 22)
+                found = True
+
+            print('%s' % r['index'])
+
+        if not found:
             print('No "%s..." indexes found' % pref)
 
     def print_unused(self, scan_counter=0, size_threshold=0):
         """Print unused indexes with"""
-        self.do_query(sql_templates['IDX_SCAN_STAT_SQL'] %
-                      (scan_counter, size_threshold))
-        stat = self.cursor.fetchall()
-
         print(' n   {:{}{}}{:{}{}}{:{}{}}{:{}{}}'
               .format('| iname', '<', '66', '| size', '<', '10',
                       '| usage', '<', '8', '| tname', '<', '42'))
 
         print('-' * 120)
 
-        i = 0
-        row_num = len(stat)
-        for s in stat:
-            if i == row_num:
-                break
-
+        columns = ['iname', 'size', 'usage', 'tname']
+        for i, s in enumerate(self.iter_query(
+                sql_templates['IDX_SCAN_STAT_SQL'], columns,
+                params=(scan_counter, size_threshold))):
             print('{:{}{}} | {:{}{}}| {:{}{}}| {:{}{}}| {:{}{}}'
-                  .format(i, '>', '4', s[0], '<', '64', s[1], '<', '8',
-                          s[2], '<', '6', s[3], '<', '42'))
-            i += 1
+                  .format(i, '>', '4', s['iname'], '<', '64',
+                          s['size'], '<', '8', s['usage'], '<', '6',
+                          s['tname'], '<', '42'))
 
     def print_bloat_top(self):
         """Print top of bloated indexes"""
-        self.do_query(sql_templates['IDX_BLOAT_STAT_SQL'])
-        stat = self.cursor.fetchall()
+        columns = ['n', 'tname', 'iname', 'size', 'bloat', 'ratio']
+        found = False
+        for s in self.iter_query(sql_templates['IDX_BLOAT_STAT_SQL'],
+                                 columns):
+            if not found:
+                print('{:{}{}}{:{}{}}{:{}{}}'
+                      '{:{}{}}{:{}{}}{:{}{}}'
+                      .format('n', '^', '4', '| tname', '<', '48',
+                              '| iname', '<', '64', '|     size', '<', '11',
+                              '| bloat', '<', '11', '| ratio', '<', 8))
+
+                print('-' * 146)
+                found = True
+
+            print('{:{}{}} | {:{}{}} | {:{}{}} | '
+                  '{:{}{}} | {:{}{}} | {:{}{}}'
+                  .format(s['n'], '>', '3', s['tname'], '<', '45',
+                          s['iname'], '<', '61', s['size'], '<', '8',
+                          s['bloat'], '<', '8', s['ratio'], '<', '8'))
+
+        if not found:
+            print('No bloated indexes found')
+
+    def has_extension(self, extname):
+        if self.do_query(sql_templates['CHECK_EXTENSION_SQL'],
+                         params=(extname,)) is False:
+            return False
 
-        if stat:
-            print('{:{}{}}{:{}{}}{:{}{}}'
-                  '{:{}{}}{:{}{}}{:{}{}}'
-                  .format('n', '^', '4', '| tname', '<', '48',
-                          '| iname', '<', '64', '|     size', '<', '11',
-                          '| bloat', '<', '11', '| ratio', '<', 8))
+        return self.cursor.fetchone() is not None
 
-            print('-' * 146)
+    def measure_bloat(self, schema, index):
+        """Measure bloat of the btree index by pgstatindex()
+        that reads the whole index. Returns (size, bloat) in bytes
+        or None if the measurement failed
+        """
+        if self.do_query(sql_templates['PGSTATINDEX_SQL'],
+                         params=(schema, index)) is False:
+            return None
+
+        size, density, leaf, empty, deleted, bs, ff = self.cursor.fetchone()
+        # avg_leaf_density is NaN for indexes without leaf pages:
+        density = float(density)
+        if density != density:
+            density = ff
+
+        # Leaf pages of a fresh index are filled up to its fillfactor
+        # (90 if it isn't set):
+        density = min(density, ff)
+        needed = leaf * density / ff
+        bloat = int((leaf - needed + empty + deleted) * bs)
+        return int(size), min(bloat, int(size))
+
+    def get_bloat_stat(self, estimator='catalog', time_budget=0):
+        """Get the bloat of indexes as a list of dictionaries
+        with raw sizes (in bytes) ordered by bloat size.
+
+        estimator - catalog (the estimate by the planner statistics),
+        pgstattuple (the biggest indexes are measured by pgstatindex()
+        while time_budget seconds aren't spent, 0 - no limit)
+        or auto (pgstattuple if the extension is installed).
+        Measured records have 'high' confidence, estimated - 'low'
+        """
+        if estimator not in ESTIMATORS:
+            err = "GlobIndexStat.get_bloat_stat(): estimator must be "\
+                  "one of %s, passed '%s'" % (', '.join(ESTIMATORS),
+                                               estimator)
+            raise ValueError(err)
 
-            for s in stat:
-                print('{:{}{}} | {:{}{}} | {:{}{}} | '
-                      '{:{}{}} | {:{}{}} | {:{}{}}'
-                      .format(s[0], '>', '3', s[1], '<', '45',
-                              s[2], '<', '61', s[3], '<', '8',
-                              s[4], '<', '8', s[5], '<', '8'))
+        records = list(self.iter_bloat())
+        if estimator == 'catalog':
+            return records
+
+        if not self.has_extension('pgstattuple'):
+            if estimator == 'pgstattuple':
+                self.logger('The pgstattuple extension is not installed, '
+                            'the catalog estimate is used', WRN)
+            return records
+
+        stat = dict(((r['schema'], r['index']), r) for r in records)
+        candidates = list(self.iter_query(
+            sql_templates['BTREE_IDX_BY_SIZE_SQL'],
+            ['schema', 'table', 'index', 'size']))
+
+        start = time.time()
+        measured = 0
+        for c in candidates:
+            if time_budget:
+                left = time_budget - (time.time() - start)
+                if left <= 0:
+                    break
+                # Don't let one huge index exceed the budget:
+                self.set_statement_timeout('%dms' % (left * 1000))
+
+            m = self.measure_bloat(c['schema'], c['index'])
+            if m is None:
+                break
 
-        else:
+            size, bloat = m
+            measured += 1
+            key = (c['schema'], c['index'])
+            if not bloat:
+                # Not bloated despite the estimate:
+                stat.pop(key, None)
+                continue
+
+            stat[key] = {'schema': c['schema'], 'table': c['table'],
+                         'index': c['index'], 'size': size, 'bloat': bloat,
+                         'ratio': round(100.0 * bloat / size, 2),
+                         'confidence': 'high'}
+
+        if time_budget:
+            self.set_statement_timeout(0)
+
+        self.logger('Bloat of %s of %s indexes is measured '
+                    'by pgstatindex()' % (measured, len(candidates)), INF)
+
+        records = list(stat.values())
+        records.sort(key=lambda r: r['bloat'], reverse=True)
+        return records
+
+    def print_bloat_records(self, records):
+        """Print bloat records (see get_bloat_stat())"""
+        if not records:
             print('No bloated indexes found')
+            return
+
+        print('{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}'
+              .format('n', '^', '4', '| tname', '<', '48',
+                      '| iname', '<', '64', '|     size', '<', '11',
+                      '| bloat', '<', '11', '| ratio', '<', '9',
+                      '| conf.', '<', 7))
+        print('-' * 154)
+
+        for n, r in enumerate(records, 1):
+            print('{:{}{}} | {:{}{}} | {:{}{}} | {:{}{}} | '
+                  '{:{}{}} | {:{}{}} | {:{}{}}'
+                  .format(n, '>', '3', r['table'], '<', '45',
+                          r['index'], '<', '61', pretty_size(r['size']),
+                          '<', '8', pretty_size(r['bloat']), '<', '8',
+                          r['ratio'], '<', '6', r['confidence'], '<', '5'))
+
+    def print_bloat_growth(self, records, days):
+        """Print growth of bloat by the snapshots of the last days,
+        records - dictionaries with 'index', 'size', 'ratio',
+        'bloat_rate' and 'days_left' keys
+        """
+        if not records:
+            print('No bloat growth during the last %s days' % days)
+            return
+
+        print('Bloat growth during the last %s days:' % days)
+        print('{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}'
+              .format('n', '^', '4', '| iname', '<', '64',
+                      '|     size', '<', '11', '| ratio', '<', '9',
+                      '| bloat/day', '<', '13', '| days left', '<', 11))
+        print('-' * 112)
+
+        for n, r in enumerate(records, 1):
+            days_left = '-'
+            if r['days_left'] is not None:
+                days_left = '%.1f' % r['days_left']
+
+            print('{:{}{}} | {:{}{}} | {:{}{}} | {:{}{}} | '
+                  '{:{}{}} | {:{}{}}'
+                  .format(n, '>', '3', r['index'], '<', '61',
+                          pretty_size(r['size']), '<', '8',
+                          '%.2f' % r['ratio'], '<', '6',
+                          pretty_size(int(r['bloat_rate'])), '<', '10',
+                          days_left, '<', '9'))
+
+    def print_unused_records(self, records):
+        """Print unused indexes with recent usage
+        (see RebuildHistory.get_trends())
+        """
+        print(' n   {:{}{}}{:{}{}}{:{}{}}{:{}{}}{:{}{}}'
+              .format('| iname', '<', '66', '| size', '<', '10',
+                      '| recent', '<', '9', '| per day', '<', '10',
+                      '| tname', '<', '42'))
+
+        print('-' * 140)
+
+        for i, r in enumerate(records):
+            # Indexes without snapshots have no rate:
+            per_day = '-'
+            if r['scans_per_day'] is not None:
+                per_day = '%.1f' % r['scans_per_day']
+
+            print('{:{}{}} | {:{}{}}| {:{}{}}| {:{}{}}| {:{}{}}| {:{}{}}'
+                  .format(i, '>', '4', r['index'], '<', '64',
+                          pretty_size(r['size']), '<', '8',
+                          r['recent_scans'], '<', '7', per_day, '<', '8',
+                          r['table'], '<', '42'))
 
     def print_invalid(self):
         """Print invalid indexes"""
-        self.do_query(sql_templates['GET_INVALID_IDX'])
-        inv_idx_list = self.cursor.fetchall()
-
-        if inv_idx_list:
-            print('Invalid indexes found:')
-            print('=' * 22)
-            for s in inv_idx_list:
-                print('%s' % s[0])
-        else:
+        found = False
+        for r in self.iter_invalid():
+            if not found:
+                print('Invalid indexes found:')
+                print('=' * 22)
+                found = True
+
+            print('%s' % r['index'])
+
+        if not found:
             print('No invalid indexes found')
 
 
@@ -296,20 +1173,43 @@ class _Relation(_DatBase):
     """
     def __init__(self, name, dbname):
         super().__init__(name, dbname)
+        # The name may be passed as [schema.]name:
+        self.schema, self.relname = split_name(name)
         self.relkind = ''
         self.relsize = 0
 
-    def check_relation(self, name=""):
-        """Check relation existence"""
-        if not name:
-            relname = self.name
-        else:
-            relname = name
+    def get_schema(self):
+        """Get the schema of the relation. The schema of a relation
+        passed without it is looked up once, the relation visible
+        by search_path is preferred. None if the relation doesn't exist
+        """
+        if self.schema is None:
+            self.do_prepared('GET_REL_SCHEMA_SQL', (self.relname,))
+            row = self.cursor.fetchone()
+            if row:
+                self.schema = row[0]
 
-        if self.__check_name(name):
-            return False
+        return self.schema
+
+    def rel_params(self, relname=''):
+        """Get (schema, relname) params of catalog lookups
+        of the relation or of another one of its schema
+        """
+        return (self.get_schema(), relname or self.relname)
 
-        self.do_query(sql_templates['GET_RELNAME'] % relname)
+    def ident(self, relname=''):
+        """Get the relation or another one of its schema
+        as a qualified sql.Identifier
+        """
+        schema, relname = self.rel_params(relname)
+        if schema is None:
+            return sql.Identifier(relname)
+
+        return sql.Identifier(schema, relname)
+
+    def check_relation(self, relname=''):
+        """Check relation existence"""
+        self.do_prepared('GET_RELNAME_SQL', self.rel_params(relname))
 
         if self.cursor.fetchone():
             return True
@@ -322,10 +1222,7 @@ class _Relation(_DatBase):
         2) 'i' - if relation is an index
         3) 'r' - if relation is a table
         """
-        if not relname:
-            relname = self.name
-
-        self.do_query(sql_templates['GET_RELKIND_SQL'] % relname)
+        self.do_prepared('GET_RELKIND_SQL', self.rel_params(relname))
         self.relkind = self.cursor.fetchone()
         if self.relkind:
             self.relkind = self.relkind[0]
@@ -333,7 +1230,7 @@ class _Relation(_DatBase):
         return self.relkind
 
     def get_relsize(self):
-        self.do_query(sql_templates['GET_RELSIZE_SQL'] % self.name)
+        self.do_prepared('GET_RELSIZE_SQL', self.rel_params())
         size = self.cursor.fetchone()[0]
         self.relsize = int(size)
 
@@ -349,16 +1246,82 @@ class Index(_Relation):
         self.__tmp_name = ''
         self.__create_new_cmd = ''
         self.itable = ''
+        self.unique = False
+        self.meta = None
+        self.engine = 'auto'
+        self.monitor = None
+        self.tuning = {'max_mem': 0, 'max_workers': None, 'work_mem': 0}
+        self.journal = None
+        self.journal_db = ''
+        self.resume = None
+        # Relocation (see set_relocation()):
+        self.tablespace = None
+        self.storage = {}
+        # Statistics of the last rebuild:
+        self.prev_size = 0
+        self.fin_size = 0
+        self.exec_time = None
 
     def get_indexdef(self):
         """Get index definition - in fact its creation command"""
-        self.do_query(sql_templates['GET_IDXDEF_SQL'] % self.name)
-        self.idef = self.cursor.fetchone()[0]
-        if 'UNIQUE' in self.idef:
-            self.logger('It\'s UNIQUE or PRIMARY KEY. Exit', ERR)
+        self.do_prepared('GET_IDXDEF_SQL', self.rel_params())
+        row = self.cursor.fetchone()
+        if not row:
+            self.logger('%s: relation does not exist' % self.name, ERR)
             return False
+
+        self.idef = row[0]
+        self.unique = self.idef.startswith('CREATE UNIQUE')
         return True
 
+    def get_tablespace(self):
+        """Get the tablespace of the index, None if it's the default one"""
+        self.do_prepared('GET_IDX_TABLESPACE_SQL', self.rel_params())
+        row = self.cursor.fetchone()
+        return row[0] if row else None
+
+    def get_constraint(self):
+        """Get a PRIMARY KEY or UNIQUE constraint that uses the index.
+        Returns a dictionary or None if there is no such constraint
+        """
+        self.do_prepared('GET_IDX_CONSTRAINT_SQL', self.rel_params())
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+
+        return {'name': row[0],
+                'type': row[1],
+                'deferrable': row[2],
+                'deferred': row[3],
+                'table': row[4],
+                'comment': row[5]}
+
+    def get_fkeys(self):
+        """Get a list of foreign keys that depend on the index"""
+        self.do_prepared('GET_IDX_FKEYS_SQL', self.rel_params())
+        fkeys = []
+        for row in self.cursor.fetchall():
+            fkeys.append({'name': row[0],
+                          'table': row[1],
+                          'def': row[2],
+                          'validated': row[3]})
+        return fkeys
+
+    def set_meta(self, meta):
+        """Use the metadata fetched by DatBaseObject.get_indexes_meta()
+        instead of querying the catalog in rebuild() one by one
+        """
+        if isinstance(meta, dict):
+            self.meta = meta
+            # The schema isn't looked up again:
+            if self.schema is None:
+                self.schema = meta.get('schema')
+        else:
+            err = "Index(): index metadata "\
+                  "must be passed as dictionary"
+            raise TypeError(err)
+            sys.exit(1)
+
     def set_idef(idef):
         if isinstance(idef, str):
             self.idef = idef
@@ -368,111 +1331,450 @@ class Index(_Relation):
             raise TypeError(err)
             sys.exit(1)
 
-    def check_validity(self, iname=''):
-        """check_validity(iname):
-        the method checks index validity
+    def check_validity(self, relname=''):
+        """check_validity(relname):
+        the method checks validity of the index
+        or of another index of its schema
         """
-        if not iname:
-            iname = self.name
+        if self.do_prepared('CHECK_IDXVALID_SQL',
+                            self.rel_params(relname)) is False:
+            return None
 
-        self.do_query(sql_templates['CHECK_IDXVALID_SQL'] % iname)
-        self.valid = self.cursor.fetchone()[0]
+        row = self.cursor.fetchone()
+        self.valid = row[0] if row else False
 
         return self.valid
 
     def get_indexcomment(self):
         """Get a comment of index if it exists"""
-        self.do_query(sql_templates['GET_IDXCOMMENT_SQL'] % self.name)
+        self.do_prepared('GET_IDXCOMMENT_SQL', self.rel_params())
         self.icomment = self.cursor.fetchone()[0]
 
     def get_indextable(self):
-        """Get table name."""
-        query = "SELECT tablename FROM pg_indexes WHERE indexname = '%s'" % self.name
-        self.do_query(query)
-        self.itable = self.cursor.fetchone()[0]
+        """Get table name qualified by its schema (quoted if needed)"""
+        if self.do_prepared('GET_IDX_TABLE_SQL', self.rel_params()) is False:
+            return ''
+
+        row = self.cursor.fetchone()
+        self.itable = row[0] if row else ''
+        return self.itable
 
     def analyze_indextable(self):
         """Analyze index table."""
-        self.get_indextable()
-        return self.do_service_query('ANALYZE %s' % self.itable)
+        if not self.itable:
+            self.get_indextable()
+        return self.do_service_query(
+            sql.SQL('ANALYZE {}').format(ident(self.itable)))
 
     def __get_tmp_name(self, pref):
         """Make a temporary name
         of a new index using concatenation
         of "pref" and a current index name
+        (the new index is created in the schema of the table)
         """
-        self.__tmp_name = pref+self.name
+        self.__tmp_name = pref+self.relname
         return self.__tmp_name
 
-    def __make_creat_new_cmd(self):
-        """Make a creation command for a new index"""
+    def set_engine(self, engine):
+        """Set rebuilding engine:
+        'native' - REINDEX INDEX CONCURRENTLY (PostgreSQL 12+),
+        'legacy' - create/drop/rename,
+        'auto' - native if the server supports it
+        """
+        if engine not in ('auto', 'native', 'legacy'):
+            err = 'Index.set_engine(): engine must be '\
+                  '"auto", "native" or "legacy", passed "%s"' % engine
+            raise ValueError(err)
+
+        self.engine = engine
+
+    def set_relocation(self, tablespace=None, storage=None):
+        """Move the index to the tablespace and change its storage
+        parameters by the rebuild. storage - dictionary {param: value},
+        an empty value resets the parameter
+        """
+        if storage is not None and not isinstance(storage, dict):
+            err = "Index.set_relocation(): storage parameters "\
+                  "must be passed as dictionary"
+            raise TypeError(err)
+
+        self.tablespace = tablespace
+        self.storage = storage or {}
+
+    def __use_native(self):
+        if self.engine == 'legacy':
+            return False
+
+        # REINDEX can move indexes to another tablespace since 14:
+        if self.tablespace and self.server_version < (14,):
+            if self.engine == 'native':
+                self.logger('REINDEX (TABLESPACE) is not supported by '
+                            'PostgreSQL %s, use legacy rebuilding' %
+                            '.'.join(str(v) for v in self.server_version),
+                            WRN)
+            return False
+
+        if self.server_version >= (12,):
+            return True
+
+        if self.engine == 'native':
+            self.logger('REINDEX CONCURRENTLY is not supported by '
+                        'PostgreSQL %s, use legacy rebuilding' %
+                        '.'.join(str(v) for v in self.server_version), WRN)
+        return False
+
+    def __rebuild_native(self):
+        """Rebuild index by REINDEX INDEX CONCURRENTLY.
+        The server builds and swaps the indexes itself, it works
+        for UNIQUE and PRIMARY KEY indexes too
+        """
+        # Queries blocking the table are canceled by it
+        # (see retry_on_lock()):
+        if self.meta:
+            self.itable = self.meta['itable']
+        elif not self.itable:
+            self.get_indextable()
+
+        # The new storage parameters are used by the build:
+        if self.storage and not self.__alter_storage():
+            return False
+
+        self.logger('Try: %s' % self.as_string(self.__reindex_cmd()))
+        if self.reindex_concurrently():
+            self.logger('Reindexing has been completed')
+            return True
+        else:
+            msg = '%s: reindexing FAILED. Check and drop '\
+                  'the invalid %s_ccnew index manually '\
+                  'or rerun with --resume' % (self.name, self.relname)
+            self.logger(msg, ERR)
+            return False
+
+    def __alter_storage(self):
+        """Change storage parameters of the index before REINDEX"""
+        queries = []
+        params = [sql.SQL('{}={}').format(sql.Identifier(p), sql.Literal(v))
+                  for p, v in sorted(self.storage.items()) if v]
+        if params:
+            queries.append(sql.SQL('ALTER INDEX {} SET ({})').format(
+                self.ident(), sql.SQL(', ').join(params)))
+
+        params = [sql.Identifier(p)
+                  for p, v in sorted(self.storage.items()) if not v]
+        if params:
+            queries.append(sql.SQL('ALTER INDEX {} RESET ({})').format(
+                self.ident(), sql.SQL(', ').join(params)))
+
+        for q in queries:
+            self.logger('Try: %s' % self.as_string(q))
+            if not self.retry_on_lock(lambda: self.do_service_query(q),
+                                      self.itable):
+                msg = '%s: changing of storage parameters FAILED' % self.name
+                self.logger(msg, ERR)
+                return False
+
+        return True
+
+    def __make_creat_new_cmd(self, tablespace=None):
+        """Make a creation command for a new index,
+        tablespace - the current tablespace of the index
+        (pg_get_indexdef() omits it)
+        """
         if not self.__tmp_name:
             err = 'Index.__make_creat_new_cmd(): '\
                   'self.__tmp_name must be predefined'
             raise ValueError(err)
             sys.exit(1)
 
-        c = self.idef.split()
-        c[1] = 'INDEX CONCURRENTLY'
-        c[2] = self.__tmp_name
-        self.__creat_new_cmd = ' '.join(c)
+        idef = IndexDef(self.idef)
+        idef.set_tablespace(self.tablespace or tablespace)
+        idef.set_storage(self.storage)
+        self.__creat_new_cmd = idef.format(quote_ident(self.__tmp_name),
+                                           concurrently=True)
+
+    def set_progress_monitor(self, monitor):
+        if isinstance(monitor, ProgressMonitor):
+            self.monitor = monitor
+        else:
+            err = "Index.set_progress_monitor() requires "\
+                  "an argument as an object of the ProgressMonitor class, "\
+                  "passed %s" % type(monitor)
+            raise TypeError(err)
+
+    def set_journal(self, journal, dbname, resume=None):
+        """Record rebuilding steps to the journal under the dbname key.
+        resume - the last journal entry of an interrupted rebuild
+        of the index to continue (see RebuildJournal.last())
+        """
+        if not isinstance(journal, RebuildJournal):
+            err = "Index.set_journal() requires "\
+                  "an argument as an object of the RebuildJournal class, "\
+                  "passed %s" % type(journal)
+            raise TypeError(err)
+
+        self.journal = journal
+        self.journal_db = dbname
+        self.resume = resume
+
+    def __journal_step(self, step, **extra):
+        if self.journal:
+            self.journal.record(self.journal_db, self.name, step, **extra)
+
+    def get_cc_leftovers(self):
+        """Get names of invalid <index>_ccnew and <index>_ccold indexes
+        of the index table left by an interrupted REINDEX CONCURRENTLY
+        (the suffix may be followed by a number and the name may be
+        truncated)
+        """
+        if self.do_prepared('GET_IDX_CC_LEFTOVERS_SQL',
+                            self.rel_params()) is False:
+            return []
+
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def __drop_cc_leftovers(self):
+        """Drop invalid indexes left by an interrupted REINDEX
+        CONCURRENTLY of the index, they are only reported
+        if the rebuild isn't resumed
+        """
+        leftovers = self.get_cc_leftovers()
+        if not leftovers:
+            return True
+
+        if not self.resume:
+            msg = '%s: invalid %s left by an interrupted REINDEX, '\
+                  'rerun with --resume or drop them '\
+                  'manually' % (self.name, ', '.join(leftovers))
+            self.logger(msg, WRN)
+            return True
+
+        if not self.itable:
+            self.itable = self.meta['itable'] if self.meta \
+                else self.get_indextable()
+
+        for iname in leftovers:
+            if not self.__drop_leftover(iname):
+                return False
+
+        return True
+
+    def __drop_leftover(self, iname):
+        """Drop an invalid index left by an interrupted run"""
+        if not self.get_relkind(iname) or self.check_validity(iname):
+            return True
+
+        self.logger('Try to drop invalid index %s '
+                    'left by the interrupted run' % iname)
+        if self.retry_on_lock(lambda: self.drop(iname), self.itable):
+            self.logger('Dropping done')
+            return True
+
+        msg = '%s: dropping FAILED. Drop it manually' % iname
+        self.logger(msg, ERR)
+        return False
+
+    def set_tuning(self, max_mem=0, max_workers=None, work_mem=0):
+        """Set limits of session settings for index builds,
+        the settings are scaled with the index size
+        (see planner.tune_build())
+        """
+        self.tuning = {'max_mem': max_mem,
+                       'max_workers': max_workers,
+                       'work_mem': work_mem}
+
+    def __set_build_settings(self):
+        settings = tune_build(self.relsize, **self.tuning)
+        # The setting appeared in PostgreSQL 11:
+        if self.server_version < (11,):
+            settings.pop('max_parallel_maintenance_workers', None)
+
+        for setting, value in sorted(settings.items()):
+            query = sql.SQL('SET {} = {}').format(sql.Identifier(setting),
+                                                  sql.Literal(str(value)))
+            if self.do_service_query(query):
+                self.logger("Set %s '%s': success" % (setting, value))
+            else:
+                self.logger("Set %s '%s': failure" % (setting, value), WRN)
+
+        return settings
+
+    def __do_build_query(self, query):
+        """Do the index building query with tuned session settings
+        reporting its progress if the progress monitor is set
+        """
+        settings = self.__set_build_settings()
+
+        if self.monitor:
+            self.monitor.start(self.get_backend_pid(), self.name)
+
+        try:
+            return self.do_service_query(query)
+        finally:
+            if self.monitor:
+                self.monitor.stop()
+
+            for setting in settings:
+                self.do_service_query(
+                    sql.SQL('RESET {}').format(sql.Identifier(setting)))
 
     def create_new(self):
-        return self.do_service_query(self.__creat_new_cmd)
+        return self.__do_build_query(self.__creat_new_cmd)
+
+    def __reindex_cmd(self):
+        if self.tablespace:
+            return sql.SQL('REINDEX (TABLESPACE {}) INDEX CONCURRENTLY {}')\
+                .format(sql.Identifier(self.tablespace), self.ident())
 
+        return sql.SQL('REINDEX INDEX CONCURRENTLY {}').format(self.ident())
+
+    def reindex_concurrently(self):
+        return self.__do_build_query(self.__reindex_cmd())
+
+    # Index names below are names of indexes of the index schema:
     def drop(self, iname):
-        return self.do_service_query('DROP INDEX CONCURRENTLY %s' % iname)
+        return self.do_service_query(
+            sql.SQL('DROP INDEX CONCURRENTLY {}').format(self.ident(iname)))
 
     def rename(self, src_iname, final_iname):
-        return self.do_service_query('ALTER INDEX %s RENAME TO %s' %
-                                     (src_iname, final_iname))
+        return self.do_service_query(
+            sql.SQL('ALTER INDEX {} RENAME TO {}').format(
+                self.ident(src_iname), sql.Identifier(final_iname)))
 
     def add_comment(self, iname, icomment):
-        return self.do_service_query("COMMENT ON INDEX %s IS '%s';" %
-                                     (iname, icomment))
+        return self.do_service_query(
+            sql.SQL('COMMENT ON INDEX {} IS {}').format(
+                self.ident(iname), sql.Literal(icomment)))
+
+    def __swap_constraint(self, constraint, fkeys):
+        """Replace the old index by the new one in a short transaction
+        guarded by lock_timeout: drop the dependent foreign keys,
+        replace the constraint by one using the new index
+        (or drop the old index and rename the new one),
+        add the foreign keys back as NOT VALID.
+        The foreign keys are validated after the transaction
+        without blocking writes
+        """
+        queries = []
+        for fk in fkeys:
+            queries.append(sql.SQL('ALTER TABLE {} DROP CONSTRAINT {}').format(
+                ident(fk['table']), sql.Identifier(fk['name'])))
+
+        if constraint:
+            # USING INDEX renames the new index to the constraint name
+            # that is the same as the old index name:
+            if constraint['type'] == 'p':
+                contype = 'PRIMARY KEY'
+            else:
+                contype = 'UNIQUE'
+
+            deferrable = ''
+            if constraint['deferrable']:
+                deferrable = ' DEFERRABLE'
+                if constraint['deferred']:
+                    deferrable += ' INITIALLY DEFERRED'
+
+            table = ident(constraint['table'])
+            name = sql.Identifier(constraint['name'])
+            queries.append(sql.SQL('ALTER TABLE {} DROP CONSTRAINT {}')
+                           .format(table, name))
+            queries.append(sql.SQL('ALTER TABLE {} ADD CONSTRAINT {} {} '
+                                   'USING INDEX {}{}')
+                           .format(table, name, sql.SQL(contype),
+                                   sql.Identifier(self.__tmp_name),
+                                   sql.SQL(deferrable)))
+            if constraint['comment']:
+                queries.append(sql.SQL('COMMENT ON CONSTRAINT {} ON {} IS {}')
+                               .format(name, table,
+                                       sql.Literal(constraint['comment'])))
+        else:
+            queries.append(sql.SQL('DROP INDEX {}').format(self.ident()))
+            queries.append(sql.SQL('ALTER INDEX {} RENAME TO {}').format(
+                self.ident(self.__tmp_name), sql.Identifier(self.relname)))
+
+        for fk in fkeys:
+            fkdef = fk['def']
+            if 'NOT VALID' not in fkdef:
+                fkdef += ' NOT VALID'
+            # The definition is made by pg_get_constraintdef():
+            queries.append(sql.SQL('ALTER TABLE {} ADD CONSTRAINT {} {}')
+                           .format(ident(fk['table']),
+                                   sql.Identifier(fk['name']),
+                                   sql.SQL(fkdef)))
+
+        def swap():
+            self.do_service_query('BEGIN')
+            for q in queries:
+                self.logger('Try: %s' % self.as_string(q))
+                if not self.do_service_query(q):
+                    self.do_service_query('ROLLBACK')
+                    return False
+
+            return self.do_service_query('COMMIT')
+
+        self.logger('Try to swap index %s with %s' % (self.name,
+                                                      self.__tmp_name))
+        table = constraint['table'] if constraint else self.itable
+        if not self.retry_on_lock(swap, table):
+            msg = '%s: swapping FAILED, new index %s is left. '\
+                  'Swap or drop it manually' % (self.name, self.__tmp_name)
+            self.logger(msg, WRN)
+            return False
 
-    def rebuild(self):
-        """Rebuild index concurrently (without table locking)"""
-        # For exec time statistics:
-        start_time = datetime.datetime.now()
+        self.logger('Swapping is done')
+        self.__journal_step('renamed')
 
-        # If the relation does not exist or if it isn't an index,
-        # exit the function:
-        relkind = self.get_relkind()
-        if not relkind:
-            msg = '%s: relation does not exist. Exit' % self.name
-            self.logger(msg, ERR)
-            return False
+        # Validation takes SHARE UPDATE EXCLUSIVE lock only:
+        for fk in fkeys:
+            if not fk['validated']:
+                continue
 
-        if relkind != 'i':
-            msg = '%s: relation is not an index. Exit' % self.name
-            self.logger(msg, ERR)
-            return False
+            query = sql.SQL('ALTER TABLE {} VALIDATE CONSTRAINT {}').format(
+                ident(fk['table']), sql.Identifier(fk['name']))
+            if self.do_service_query(query):
+                self.logger('Foreign key %s is validated' % fk['name'])
+            else:
+                msg = '%s: foreign key is NOT validated. '\
+                      'Validate it manually' % fk['name']
+                self.logger(msg, WRN)
 
-        # For size difference after/before statistics:
-        prev_size = self.get_relsize()
-        self.logger('Start to rebuild of %s, '
-                    'current size: %s bytes' % (self.name, prev_size))
+        return True
 
-        #
-        # 1. Check validity of the current index
-        #
-        if not self.check_validity():
-            msg = '%s: index is invalid. Check it' % self.name
-            self.logger(msg, WRN)
-            return False
-        else:
-            self.logger('Index is valid')
+    def __rebuild_legacy(self):
+        """Rebuild index by creation of a new index concurrently,
+        dropping the old one and renaming the new one
+        """
+        meta = self.meta
 
         #
         # 2. Get the current index definition
         #
-        self.get_indexdef()
+        if meta:
+            self.idef = meta['idef']
+            self.itable = meta['itable']
+            self.unique = meta['unique']
+        elif not self.get_indexdef():
+            return False
+
+        # UNIQUE and PRIMARY KEY indexes can back a constraint
+        # and can be referenced by foreign keys:
+        constraint = None
+        fkeys = []
+        if self.unique:
+            constraint = self.get_constraint()
+            fkeys = self.get_fkeys()
+            if constraint:
+                self.logger('Index backs constraint %s' % constraint['name'])
+            if fkeys:
+                self.logger('Foreign keys depend on the index: %s' %
+                            ', '.join(fk['name'] for fk in fkeys))
 
         #
         # 3. Get the index comment if it exists
         #
-        self.get_indexcomment()
+        if meta:
+            self.icomment = meta['icomment']
+        else:
+            self.get_indexcomment()
 
         #
         # 4. Get a temporary name for a new index
@@ -481,9 +1783,25 @@ class Index(_Relation):
 
         # If the relation does not exist or if it's not an index,
         # exit the function:
-        relkind = self.get_relkind(self.__tmp_name)
-        if relkind:
-            if not self.check_validity(self.__tmp_name):
+        if meta:
+            tmp_exists = meta['tmp_exists']
+            tmp_valid = meta['tmp_valid']
+        else:
+            tmp_exists = self.get_relkind(self.__tmp_name)
+            tmp_valid = tmp_exists and self.check_validity(self.__tmp_name)
+
+        # The new index is left by the interrupted run:
+        if tmp_exists and self.resume:
+            if tmp_valid:
+                self.logger('Resume rebuilding by the existing '
+                            'new index %s' % self.__tmp_name)
+            elif self.__drop_leftover(self.__tmp_name):
+                tmp_exists = False
+            else:
+                return False
+
+        elif tmp_exists:
+            if not tmp_valid:
                 msg = '%s: relation exists now and '\
                       'it\'s invalid. Exit' % self.__tmp_name
             else:
@@ -492,27 +1810,37 @@ class Index(_Relation):
             self.logger(msg, ERR)
             return False
 
-        #
-        # 5. Make the creation command
-        #
-        self.__make_creat_new_cmd()
+        if not tmp_exists:
+            #
+            # 5. Make the creation command
+            #
+            try:
+                self.__make_creat_new_cmd(meta['tablespace'] if meta
+                                          else self.get_tablespace())
+            except ValueError as e:
+                self.logger('%s: %s' % (self.name, e), ERR)
+                return False
 
-        #
-        # 6. Create the new index
-        #
-        self.logger('Try: %s' % self.__creat_new_cmd)
-        if self.create_new():
-            self.logger('Creation has been completed')
-        else:
-            msg = '%s: creation FAILED' % self.__tmp_name
-            self.logger(msg, ERR)
-            return False
+            #
+            # 6. Create the new index
+            #
+            self.logger('Try: %s' % self.__creat_new_cmd)
+            if self.create_new():
+                self.logger('Creation has been completed')
+                self.__journal_step('created')
+            else:
+                msg = '%s: creation FAILED' % self.__tmp_name
+                self.logger(msg, ERR)
+                return False
 
         #
         # 7. ANALYZE table
         #
-        if self.analyze_indextable():
+        if tmp_exists and self.resume['step'] == 'analyzed':
+            self.logger('The table has been analyzed by the interrupted run')
+        elif self.analyze_indextable():
             self.logger('Analyze done')
+            self.__journal_step('analyzed')
         else:
             msg = '%s: ANALYZE FAILED' % self.__tmp_name
             self.logger(msg, ERR)
@@ -541,13 +1869,35 @@ class Index(_Relation):
         else:
             self.logger('New index %s is valid, continue' % self.__tmp_name)
 
+        # The constraint and the foreign keys don't allow
+        # to drop the old index, swap the indexes in a transaction:
+        if constraint or fkeys:
+            return self.__swap_constraint(constraint, fkeys)
+
+        return self.__replace_old()
+
+    def __replace_old(self):
+        """Drop the old index and rename the new one"""
         #
         # 10. Drop the old index
         #
         self.logger('Try to drop index %s' % self.name)
 
-        if self.drop(self.name):
+        # DROP INDEX CONCURRENTLY marks the index invalid and commits
+        # before it waits for transactions using the index, a lock
+        # timeout during the wait would leave it invalid. So it's
+        # done without lock_timeout: the only lock it takes
+        # (SHARE UPDATE EXCLUSIVE) doesn't block reads and writes:
+        self.set_lock_timeout('0')
+        if self.drop(self.relname):
             self.logger('Dropping done')
+            self.__journal_step('dropped')
+        elif self.check_validity() is False:
+            msg = '%s: rebuilding FAILED, the index is marked invalid '\
+                  'but is NOT dropped, run --cleanup to replace it '\
+                  'by %s' % (self.name, self.__tmp_name)
+            self.logger(msg, ERR)
+            return False
         else:
             # If index has not been dropped, exit the function:
             msg = '%s: rebuilding FAILED, '\
@@ -563,38 +1913,213 @@ class Index(_Relation):
         # rename the new index to a persistent name
         # (as the name of the dropped index).
         # Altering index locks a table,
-        # therefore it needs to set allowable statement timeout
-        # for this action in order to prevent queues of queries:
-        if self.set_statement_timeout(self.lock_query_timeo):
-            self.logger("Set statement timeout '%s': success" %
-                        self.lock_query_timeo)
-        else:
-            self.logger("Set statement timeout '%s': failure" %
-                        self.lock_query_timeo, ERR)
-
+        # therefore it's done by short attempts guarded by lock timeout
+        # in order to prevent queues of queries (see retry_on_lock()):
         self.logger('Try to rename index %s to %s' % (
                     self.__tmp_name, self.name))
-        if self.rename(self.__tmp_name, self.name):
+        if self.retry_on_lock(lambda: self.rename(self.__tmp_name,
+                                                  self.relname),
+                              self.itable):
             self.logger('Renaming is done')
+            self.__journal_step('renamed')
         else:
             msg = '%s: renaming FAILED. Do it manually' % self.__tmp_name
             self.logger(msg, WRN)
             return False
 
+        return True
+
+    def __finish_rename(self):
+        """Finish the rebuild interrupted after dropping
+        of the old index by renaming the new one
+        """
+        if self.get_relkind():
+            msg = '%s: relation exists now, the interrupted rebuild '\
+                  'can\'t be finished. Check it' % self.name
+            self.logger(msg, ERR)
+            return False
+
+        if not self.get_relkind(self.__tmp_name):
+            msg = '%s: relation does not exist, the interrupted rebuild '\
+                  'can\'t be finished. Check it' % self.__tmp_name
+            self.logger(msg, ERR)
+            return False
+
+        self.logger('Try to rename index %s to %s' % (
+                    self.__tmp_name, self.name))
+        if self.retry_on_lock(lambda: self.rename(self.__tmp_name,
+                                                  self.relname),
+                              self.itable):
+            self.logger('Renaming is done')
+            self.__journal_step('renamed')
+            return True
+
+        msg = '%s: renaming FAILED. Do it manually' % self.__tmp_name
+        self.logger(msg, WRN)
+        return False
+
+    def recover(self, orphan):
+        """Finish or roll back the interrupted rebuild of the index
+        by the new index left by it (see DatBaseObject.get_orphans()):
+        an invalid new index is dropped, a valid one replaces
+        the old index or is renamed if the old one has been dropped.
+        Returns the done action ('dropped', 'swapped', 'renamed')
+        or False
+        """
+        self.__tmp_name = orphan['tmp_name']
+        self.itable = orphan['itable']
+
+        if not orphan['tmp_valid']:
+            if not orphan['orig_exists']:
+                msg = '%s: the new index is invalid and the old one '\
+                      'does not exist. Rebuild it manually' % self.__tmp_name
+                self.logger(msg, WRN)
+                return False
+
+            # It's updated by every write but is never used:
+            self.logger('Try to drop invalid index %s' % self.__tmp_name)
+            if self.retry_on_lock(lambda: self.drop(self.__tmp_name),
+                                  self.itable):
+                self.logger('Dropping done')
+                return 'dropped'
+
+            msg = '%s: dropping FAILED' % self.__tmp_name
+            self.logger(msg, WRN)
+            return False
+
+        if not orphan['orig_exists']:
+            return 'renamed' if self.__finish_rename() else False
+
+        # The new index replaces the old one as the rebuild would do:
+        if not self.get_indexdef():
+            return False
+
+        self.get_indexcomment()
+        if self.icomment:
+            self.logger("Add comment: '%s'" % self.icomment)
+            if not self.add_comment(self.__tmp_name, self.icomment):
+                msg = '%s: comment has NOT been added' % self.__tmp_name
+                self.logger(msg, WRN)
+
+        if self.unique:
+            constraint = self.get_constraint()
+            fkeys = self.get_fkeys()
+            if constraint or fkeys:
+                done = self.__swap_constraint(constraint, fkeys)
+                return 'swapped' if done else False
+
+        return 'swapped' if self.__replace_old() else False
+
+    def rebuild(self):
+        """Rebuild index concurrently (without table locking)"""
+        # For exec time statistics:
+        start_time = datetime.datetime.now()
+
+        # The metadata can be fetched for the whole batch beforehand
+        # (see DatBaseObject.get_indexes_meta()):
+        meta = self.meta
+
+        # The old index has been dropped by the interrupted run,
+        # only renaming of the new one is left:
+        if self.resume and self.resume['step'] == 'dropped':
+            prev_size = self.resume.get('size', 0)
+            self.relsize = prev_size
+            self.itable = self.resume.get('table', '')
+            if self.schema is None and self.itable:
+                # The old index can't be found anymore,
+                # indexes are in the schema of their table:
+                self.schema = split_name(self.itable)[0]
+            self.__get_tmp_name('new_')
+            if not self.__finish_rename():
+                return False
+
+            return self.__finish_stat(start_time, prev_size)
+
+        # If the relation does not exist or if it isn't an index,
+        # exit the function:
+        relkind = meta['relkind'] if meta else self.get_relkind()
+        if not relkind:
+            msg = '%s: relation does not exist. Exit' % self.name
+            self.logger(msg, ERR)
+            return False
+
+        if relkind == 'I':
+            msg = '%s: partitioned index, rebuild indexes '\
+                  'of its partitions. Exit' % self.name
+            self.logger(msg, ERR)
+            return False
+
+        if relkind != 'i':
+            msg = '%s: relation is not an index. Exit' % self.name
+            self.logger(msg, ERR)
+            return False
+
+        # For size difference after/before statistics:
+        prev_size = meta['relsize'] if meta else self.get_relsize()
+        self.relsize = prev_size
+        self.logger('Start to rebuild of %s, '
+                    'current size: %s bytes' % (self.name, prev_size))
+
         #
-        # Reset the statement timeout that was established previously:
+        # 1. Check validity of the current index
         #
-        if self.set_statement_timeout('0'):
-            self.logger("Reset statement timeout to '0': success")
+        valid = meta['valid'] if meta else self.check_validity()
+        if not valid:
+            msg = '%s: index is invalid. Check it' % self.name
+            self.logger(msg, WRN)
+            return False
         else:
-            self.logger("Reset statement timeout to '0': failure", ERR)
+            self.logger('Index is valid')
+
+        # An interrupted REINDEX CONCURRENTLY leaves invalid copies
+        # of the index, they would be updated by every write:
+        if not self.__drop_cc_leftovers():
+            return False
+
+        self.__journal_step('started', size=prev_size,
+                            table=meta['itable'] if meta else '')
+
+        # An index attached to a partitioned index can't be dropped,
+        # REINDEX CONCURRENTLY keeps it attached:
+        attached = meta.get('attached') if meta else False
+        if attached and self.server_version < (12,):
+            msg = '%s: index of a partition can be rebuilt '\
+                  'on PostgreSQL 12+ only. Exit' % self.name
+            self.logger(msg, ERR)
+            return False
+
+        if attached and self.tablespace and self.server_version < (14,):
+            msg = '%s: index of a partition can be moved to another '\
+                  'tablespace on PostgreSQL 14+ only. Exit' % self.name
+            self.logger(msg, ERR)
+            return False
+
+        # Rebuild the index by REINDEX CONCURRENTLY (PostgreSQL 12+)
+        # or by creation of a new index and swapping of them:
+        if attached or self.__use_native():
+            done = self.__rebuild_native()
+        else:
+            done = self.__rebuild_legacy()
+
+        if not done:
+            return False
+
+        return self.__finish_stat(start_time, prev_size)
+
+    def __finish_stat(self, start_time, prev_size):
+        """Make time execution statistics and return it"""
+        self.__journal_step('done')
 
-        # Make time execution statistics and return it:
         fin_size = self.get_relsize()
         diff = prev_size - fin_size
 
         end_time = datetime.datetime.now()
         exec_time = end_time - start_time
+
+        self.prev_size = prev_size
+        self.fin_size = fin_size
+        self.exec_time = exec_time
+
         stat = '%s: done. Size (in bytes): prev %s, '\
                'fin %s, diff %s, exec time %s' % (self.name, prev_size,
                                                   fin_size, diff, exec_time)
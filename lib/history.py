@@ -0,0 +1,145 @@
+# history - The local store of index rebuilding history
+# Date: 17-10-2026
+
+import datetime
+import sqlite3
+import threading
+
+from lib.planner import DEFAULT_THROUGHPUT, estimate_time
+
+# Number of the latest rebuilds of an access method
+# used for the throughput estimate:
+MODEL_SAMPLES = 50
+
+# Index statistics snapshots older than that (days) are deleted:
+SNAPSHOT_KEEP_DAYS = 90
+# Minimal time between the first and the last snapshot (days)
+# to compute rates:
+MIN_TREND_SPAN = 1.0 / 24
+
+
+class RebuildHistory(object):
+    """Class for storing timings of index rebuilds
+    in a local SQLite database and predicting rebuild time
+    by the throughput (bytes/sec) of the previous rebuilds
+    of the same access method. Snapshots of index statistics
+    are stored there as well to track bloat growth and usage
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        # The object is shared between the scheduler workers:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS rebuilds ('
+                        'ts TEXT, dbname TEXT, iname TEXT, amname TEXT, '
+                        'size INTEGER, fin_size INTEGER, exec_time REAL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                        'ts TEXT, dbname TEXT, schema TEXT, iname TEXT, '
+                        'size INTEGER, bloat INTEGER, scans INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS snapshots_db_ts '
+                        'ON snapshots (dbname, ts)')
+        self.db.commit()
+
+    def add(self, dbname, iname, amname, size, fin_size, exec_time):
+        """Add a rebuild sample, exec_time is in seconds"""
+        with self.__lock:
+            self.db.execute('INSERT INTO rebuilds '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (datetime.datetime.now().isoformat(), dbname,
+                             iname, amname, size, fin_size, exec_time))
+            self.db.commit()
+
+    def throughput(self, amname):
+        """Get rebuilding throughput (bytes/sec) of the access method
+        by the latest samples, None if there are no samples
+        """
+        with self.__lock:
+            row = self.db.execute(
+                'SELECT sum(size), sum(exec_time) FROM '
+                '(SELECT size, exec_time FROM rebuilds '
+                'WHERE amname = ? AND exec_time > 0 '
+                'ORDER BY ts DESC LIMIT ?)',
+                (amname, MODEL_SAMPLES)).fetchone()
+
+        if not row or not row[1]:
+            return None
+
+        return row[0] / row[1]
+
+    def predict(self, amname, size, default=DEFAULT_THROUGHPUT):
+        """Predict rebuild time (in seconds) of an index"""
+        return estimate_time(size, self.throughput(amname) or default)
+
+    def get_samples(self):
+        """Get all rebuild samples as a list of
+        (dbname, iname, amname, size, fin_size, exec_time) tuples
+        """
+        with self.__lock:
+            return self.db.execute('SELECT dbname, iname, amname, size, '
+                                   'fin_size, exec_time '
+                                   'FROM rebuilds').fetchall()
+
+    def add_snapshot(self, dbname, records):
+        """Add a snapshot of index statistics of the database,
+        records - (schema, iname, size, bloat, scans) tuples
+        """
+        now = datetime.datetime.now()
+        expired = now - datetime.timedelta(days=SNAPSHOT_KEEP_DAYS)
+        with self.__lock:
+            self.db.executemany('INSERT INTO snapshots '
+                                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                [(now.isoformat(), dbname) + tuple(r)
+                                 for r in records])
+            self.db.execute('DELETE FROM snapshots WHERE ts < ?',
+                            (expired.isoformat(),))
+            self.db.commit()
+
+    def get_trends(self, dbname, window=7):
+        """Get changes of index statistics of the database
+        between the first and the last snapshots of the last window days.
+        Returns a dictionary {(schema, iname): {'span': days, 'size',
+        'bloat', 'ratio' (the last values), 'bloat_rate' (bytes/day),
+        'ratio_rate' (percent/day), 'scans' (scans during the span),
+        'scans_per_day'}}
+        """
+        since = datetime.datetime.now() - datetime.timedelta(days=window)
+        with self.__lock:
+            rows = self.db.execute(
+                'SELECT ts, schema, iname, size, bloat, scans '
+                'FROM snapshots WHERE dbname = ? AND ts >= ? ORDER BY ts',
+                (dbname, since.isoformat())).fetchall()
+
+        # Indexes of different schemas may have the same name:
+        first, last = {}, {}
+        for row in rows:
+            first.setdefault(row[1:3], row)
+            last[row[1:3]] = row
+
+        trends = {}
+        for key, (ts0, _, _, size0, bloat0, scans0) in first.items():
+            ts1, _, _, size1, bloat1, scans1 = last[key]
+            span = (datetime.datetime.fromisoformat(ts1) -
+                    datetime.datetime.fromisoformat(ts0)).total_seconds()
+            span /= 86400
+            if span < MIN_TREND_SPAN:
+                continue
+
+            ratio0 = 100.0 * bloat0 / size0 if size0 else 0
+            ratio1 = 100.0 * bloat1 / size1 if size1 else 0
+
+            # The counter has been reset during the span:
+            scans = scans1 - scans0 if scans1 >= scans0 else scans1
+
+            trends[key] = {'span': span,
+                           'size': size1,
+                           'bloat': bloat1,
+                           'ratio': ratio1,
+                           'bloat_rate': (bloat1 - bloat0) / span,
+                           'ratio_rate': (ratio1 - ratio0) / span,
+                           'scans': scans,
+                           'scans_per_day': scans / span}
+
+        return trends
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,345 @@
+# indexdef - The parser of index definitions and relocation rules
+# Date: 17-10-2026
+
+import fnmatch
+import re
+
+_IDENT = r'(?:"(?:[^"]|"")*"|[^\s(),=\'".]+)'
+
+# Tokens of index definitions: string literals,
+# (qualified) names and keywords, punctuation.
+# Operators and casts are names too, they are kept as they are:
+_TOKEN_RE = re.compile(r"""
+    (?P<str>[eE]'(?:[^'\\]|''|\\.)*'|'(?:[^']|'')*')
+  | (?P<name>%s(?:\.%s)*)
+  | (?P<punct>[(),=.])
+""" % (_IDENT, _IDENT), re.X)
+
+_PARAM_RE = re.compile(r'^[a-z_][a-z0-9_]*$')
+_SIMPLE_IDENT_RE = re.compile(r'^[a-z_][a-z0-9_$]*$')
+_NAME_PART_RE = re.compile(r'"((?:[^"]|"")+)"|([^".]+)')
+
+
+def quote_ident(name):
+    """Quote the identifier if it isn't a simple lower case one"""
+    if _SIMPLE_IDENT_RE.match(name):
+        return name
+
+    return '"%s"' % name.replace('"', '""')
+
+
+def split_name(name):
+    """Split a name passed as [schema.]name into (schema or None, name).
+    Parts may be double-quoted, unquoted parts are taken as they are
+    (as relation names are shown by the statistics)
+    """
+    parts = []
+    pos = 0
+    while True:
+        m = _NAME_PART_RE.match(name, pos)
+        if not m:
+            # An empty part:
+            pos = -1
+            break
+
+        if m.group(1) is not None:
+            parts.append(m.group(1).replace('""', '"'))
+        else:
+            parts.append(m.group(2))
+
+        pos = m.end()
+        if pos == len(name) or name[pos] != '.':
+            break
+        pos += 1
+
+    if pos != len(name) or not 1 <= len(parts) <= 2:
+        err = "split_name(): name must be passed as [schema.]name, "\
+              "passed '%s'" % name
+        raise ValueError(err)
+
+    if len(parts) == 1:
+        return None, parts[0]
+
+    return parts[0], parts[1]
+
+
+def join_name(schema, name):
+    """Make a name that split_name() splits into (schema, name)"""
+    if schema is None:
+        return quote_ident(name) if '.' in name or '"' in name else name
+
+    return '%s.%s' % (quote_ident(schema), quote_ident(name))
+
+
+def quote_literal(value):
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def _tokenize(text):
+    """Split the text into (kind, text, start, end) tuples"""
+    tokens = []
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+
+        if pos == len(text):
+            return tokens
+
+        m = _TOKEN_RE.match(text, pos)
+        if not m:
+            err = "IndexDef(): unexpected character '%s' "\
+                  "at %s of the index definition" % (text[pos], pos)
+            raise ValueError(err)
+
+        tokens.append((m.lastgroup, m.group(), m.start(), m.end()))
+        pos = m.end()
+
+
+class IndexDef(object):
+    """Class for parsing and changing index definitions made
+    by pg_get_indexdef() (the indexdef column of pg_indexes):
+
+    CREATE [UNIQUE] INDEX name ON [ONLY] table USING method (columns)
+    [INCLUDE (columns)] [NULLS [NOT] DISTINCT] [WITH (storage)]
+    [TABLESPACE tablespace] [WHERE predicate]
+
+    Expressions, the predicate and storage values are kept
+    as they are written, quoted names and literals may contain
+    any keywords
+    """
+    def __init__(self, idef):
+        self.idef = idef
+        self.unique = False
+        self.name = ''
+        self.only = False
+        self.table = ''
+        self.method = ''
+        self.columns = ''
+        self.include = ''
+        self.nulls = ''
+        # List of (param, value) pairs, values are SQL text:
+        self.storage = []
+        self.tablespace = ''
+        self.where = ''
+        self.__tokens = _tokenize(idef)
+        self.__pos = 0
+        self.__parse()
+
+    def __error(self, expected):
+        if self.__pos < len(self.__tokens):
+            found = "'%s'" % self.__tokens[self.__pos][1]
+        else:
+            found = 'the end'
+        err = 'IndexDef(): %s expected, %s found '\
+              'in the index definition: %s' % (expected, found, self.idef)
+        raise ValueError(err)
+
+    def __peek(self, *keywords):
+        """Is the next token one of the keywords"""
+        if self.__pos >= len(self.__tokens):
+            return False
+
+        kind, text = self.__tokens[self.__pos][:2]
+        return kind == 'name' and text.upper() in keywords
+
+    def __keyword(self, keyword, optional=False):
+        if self.__peek(keyword):
+            self.__pos += 1
+            return True
+
+        if not optional:
+            self.__error(keyword)
+        return False
+
+    def __name(self):
+        if self.__pos >= len(self.__tokens) or \
+                self.__tokens[self.__pos][0] != 'name':
+            self.__error('a name')
+
+        self.__pos += 1
+        return self.__tokens[self.__pos - 1][1]
+
+    def __group(self):
+        """Get the parenthesized group as its text
+        and its items (lists of tokens split by top level commas)
+        """
+        if self.__pos >= len(self.__tokens) or \
+                self.__tokens[self.__pos][1] != '(':
+            self.__error("'('")
+
+        start = self.__tokens[self.__pos][2]
+        depth = 0
+        items = [[]]
+        for n in range(self.__pos, len(self.__tokens)):
+            kind, text = self.__tokens[n][:2]
+            if kind == 'punct' and text == '(':
+                depth += 1
+                if depth == 1:
+                    continue
+            elif kind == 'punct' and text == ')':
+                depth -= 1
+                if not depth:
+                    self.__pos = n + 1
+                    return self.idef[start:self.__tokens[n][3]], items
+            elif kind == 'punct' and text == ',' and depth == 1:
+                items.append([])
+                continue
+
+            items[-1].append(self.__tokens[n])
+
+        self.__pos = len(self.__tokens)
+        self.__error("')'")
+
+    def __parse(self):
+        self.__keyword('CREATE')
+        self.unique = self.__keyword('UNIQUE', optional=True)
+        self.__keyword('INDEX')
+        self.__keyword('CONCURRENTLY', optional=True)
+        if self.__keyword('IF', optional=True):
+            self.__keyword('NOT')
+            self.__keyword('EXISTS')
+
+        self.name = self.__name()
+        self.__keyword('ON')
+        self.only = self.__keyword('ONLY', optional=True)
+        self.table = self.__name()
+        self.__keyword('USING')
+        self.method = self.__name()
+        self.columns = self.__group()[0]
+
+        while self.__pos < len(self.__tokens):
+            if self.__keyword('INCLUDE', optional=True):
+                self.include = self.__group()[0]
+            elif self.__keyword('NULLS', optional=True):
+                self.nulls = 'NULLS NOT DISTINCT' \
+                    if self.__keyword('NOT', optional=True) \
+                    else 'NULLS DISTINCT'
+                self.__keyword('DISTINCT')
+            elif self.__keyword('WITH', optional=True):
+                self.storage = [self.__param(item)
+                                for item in self.__group()[1]]
+            elif self.__keyword('TABLESPACE', optional=True):
+                self.tablespace = self.__name()
+            elif self.__keyword('WHERE', optional=True):
+                self.where = self.idef[self.__tokens[self.__pos][2]:].strip()
+                self.__pos = len(self.__tokens)
+            else:
+                self.__error('INCLUDE, NULLS, WITH, TABLESPACE or WHERE')
+
+    def __param(self, item):
+        if len(item) < 3 or item[0][0] != 'name' or item[1][1] != '=':
+            err = 'IndexDef(): storage parameters must be '\
+                  'param=value pairs: %s' % self.idef
+            raise ValueError(err)
+
+        return item[0][1], self.idef[item[2][2]:item[-1][3]]
+
+    def set_tablespace(self, tablespace):
+        """Move the index to the tablespace,
+        '' means the default tablespace of the database
+        """
+        self.tablespace = quote_ident(tablespace) if tablespace else ''
+
+    def set_storage(self, storage):
+        """Change storage parameters, storage - dictionary
+        {param: value}, an empty value resets the parameter
+        """
+        params = dict(self.storage)
+        for param, value in storage.items():
+            check_param(param)
+            if value == '':
+                params.pop(param, None)
+            else:
+                params[param] = quote_literal(value)
+
+        # The order of the existing parameters is kept:
+        self.storage = [(p, params[p]) for p, v in self.storage
+                        if p in params]
+        self.storage += [(p, v) for p, v in params.items()
+                         if p not in dict(self.storage)]
+
+    def format(self, name=None, concurrently=False):
+        """Make the creation command, name - a new name of the index"""
+        parts = ['CREATE']
+        if self.unique:
+            parts.append('UNIQUE')
+        parts.append('INDEX')
+        if concurrently:
+            parts.append('CONCURRENTLY')
+        parts += [name or self.name, 'ON']
+        if self.only:
+            parts.append('ONLY')
+        parts += [self.table, 'USING', self.method, self.columns]
+        if self.include:
+            parts += ['INCLUDE', self.include]
+        if self.nulls:
+            parts.append(self.nulls)
+        if self.storage:
+            parts.append('WITH (%s)' % ', '.join('%s=%s' % p
+                                                 for p in self.storage))
+        if self.tablespace:
+            parts += ['TABLESPACE', self.tablespace]
+        if self.where:
+            parts += ['WHERE', self.where]
+
+        return ' '.join(parts)
+
+
+def check_param(param):
+    if not _PARAM_RE.match(param):
+        err = "check_param(): storage parameter must be "\
+              "a lower case name, passed '%s'" % param
+        raise ValueError(err)
+
+
+def parse_options(items):
+    """Parse 'param=value' items of relocation options,
+    'tablespace=name' sets the tablespace, the others are storage
+    parameters. Returns (tablespace or None, storage dictionary)
+    """
+    tablespace = None
+    storage = {}
+    for item in items:
+        if '=' not in item:
+            err = "parse_options(): options must be passed "\
+                  "as param=value, passed '%s'" % item
+            raise ValueError(err)
+
+        param, value = [s.strip() for s in item.split('=', 1)]
+        if param == 'tablespace':
+            tablespace = value
+        else:
+            check_param(param)
+            storage[param] = value
+
+    return tablespace, storage
+
+
+def load_rules(path):
+    """Read relocation rules from the file, one rule per line:
+    an index name or a pattern (see fnmatch) followed
+    by options (see parse_options()), '#' starts a comment.
+    Returns a list of (pattern, tablespace, storage) tuples
+    """
+    rules = []
+    with open(path, 'r') as fp:
+        for line in fp:
+            line = line.split('#', 1)[0].split()
+            if not line:
+                continue
+
+            rules.append((line[0],) + parse_options(line[1:]))
+
+    return rules
+
+
+def match_rule(rules, iname):
+    """Get (tablespace, storage) of the first rule
+    matching the index name, (None, {}) if there is no one
+    """
+    for pattern, tablespace, storage in rules:
+        if fnmatch.fnmatchcase(iname, pattern):
+            return tablespace, storage
+
+    return None, {}
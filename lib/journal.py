@@ -0,0 +1,99 @@
+# journal - The write-ahead journal of index rebuilding steps
+# Date: 17-10-2026
+
+import datetime
+import json
+import os
+import threading
+
+# Steps of rebuilding of an index in the order they are done
+# ('batch' marks the start of a new run):
+STEPS = ('started', 'created', 'analyzed', 'dropped', 'renamed', 'done')
+
+
+class RebuildJournal(object):
+    """Class for recording steps of index rebuilds
+    to a JSON Lines file. Every line is flushed to the disk
+    before the next step is started, so an interrupted batch
+    can be resumed (see the --resume arg)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__last = {}
+        torn = self.__load()
+        # The object is shared between the scheduler workers:
+        self.fp = open(path, 'a')
+        if torn:
+            # Don't glue the next entry to the torn one:
+            self.fp.write('\n')
+
+    def __load(self):
+        """Read the last step of every index of the current batch,
+        returns True if the last line is torn by a crash
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        line = '\n'
+        with open(self.path, 'r') as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line torn by a crash:
+                    continue
+
+                if entry.get('step') == 'batch':
+                    self.__last = {}
+                    continue
+
+                self.__update(entry)
+
+        return not line.endswith('\n')
+
+    def __update(self, entry):
+        # Extra keys of the previous steps (the size and the table
+        # recorded at the start) are kept:
+        key = (entry['db'], entry['index'])
+        self.__last[key] = dict(self.__last.get(key, {}), **entry)
+
+    def __write(self, entry):
+        entry['ts'] = datetime.datetime.now().isoformat()
+        with self.__lock:
+            self.fp.write(json.dumps(entry) + '\n')
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+
+    def start_batch(self):
+        """Mark the start of a new batch, steps of the previous
+        batches aren't resumed after that
+        """
+        self.__write({'step': 'batch'})
+        with self.__lock:
+            self.__last = {}
+
+    def record(self, dbname, iname, step, **extra):
+        """Record the step of rebuilding of the index,
+        extra keys are stored with the step
+        """
+        if step not in STEPS:
+            err = "RebuildJournal.record(): step must be one of %s, "\
+                  "passed '%s'" % (', '.join(STEPS), step)
+            raise ValueError(err)
+
+        entry = {'db': dbname, 'index': iname, 'step': step}
+        entry.update(extra)
+        self.__write(entry)
+        with self.__lock:
+            self.__update(entry)
+
+    def last(self, dbname, iname):
+        """Get the last recorded entry of the index in the current batch
+        merged with the previous ones, None if there is no one
+        """
+        with self.__lock:
+            return self.__last.get((dbname, iname))
+
+    def close(self):
+        self.fp.close()
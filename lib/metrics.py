@@ -0,0 +1,202 @@
+# metrics - The Prometheus (OpenMetrics text format) exporter
+# of index statistics and rebuild history
+# Date: 17-10-2026
+
+import datetime
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lib.database import GlobIndexStat
+
+PREFIX = 'index_rebuilder_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets of rebuild duration (seconds)
+# and of reclaimed bytes:
+DURATION_BUCKETS = [1, 10, 60, 300, 900, 3600, 4 * 3600]
+RECLAIMED_BUCKETS = [1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2,
+                     1024 ** 3, 10 * 1024 ** 3, 100 * 1024 ** 3]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+                     .replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                             for k, v in sorted(labels.items()))
+
+
+def format_gauge(name, help_text, samples):
+    """Format a gauge, samples - list of (labels dict, value) pairs"""
+    lines = ['# HELP %s%s %s' % (PREFIX, name, help_text),
+             '# TYPE %s%s gauge' % (PREFIX, name)]
+    for labels, value in samples:
+        lines.append('%s%s%s %s' % (PREFIX, name, _labels(labels), value))
+
+    return lines
+
+
+def format_histogram(name, help_text, buckets, observations):
+    """Format a histogram, observations - dict
+    {labels tuple of (key, value) pairs: list of values}
+    """
+    lines = ['# HELP %s%s %s' % (PREFIX, name, help_text),
+             '# TYPE %s%s histogram' % (PREFIX, name)]
+    for key, values in sorted(observations.items()):
+        labels = dict(key)
+        for le in buckets:
+            labels['le'] = le
+            lines.append('%s%s_bucket%s %s' % (
+                PREFIX, name, _labels(labels),
+                sum(1 for v in values if v <= le)))
+
+        labels['le'] = '+Inf'
+        lines.append('%s%s_bucket%s %s' % (PREFIX, name, _labels(labels),
+                                           len(values)))
+        del labels['le']
+        lines.append('%s%s_sum%s %s' % (PREFIX, name, _labels(labels),
+                                        sum(values)))
+        lines.append('%s%s_count%s %s' % (PREFIX, name, _labels(labels),
+                                          len(values)))
+
+    return lines
+
+
+def collect_index_metrics(sessions, history=None):
+    """Collect metrics of indexes of all the sessions
+    and of the rebuild history, returns the exposition text.
+    sessions - list of (database name, Session) pairs,
+    the sessions are kept between collections
+    and reconnect by themselves if needed
+    """
+    size, scans, valid, bloat, ratio, up = [], [], [], [], [], []
+    for name, session in sessions:
+        idx_stat = GlobIndexStat(session.dbname)
+        if not idx_stat.set_session(session):
+            up.append(({'db': name}, 0))
+            continue
+
+        try:
+            for r in idx_stat.iter_indexes():
+                labels = {'db': name, 'schema': r['schema'],
+                          'table': r['table'], 'index': r['index']}
+                size.append((labels, r['size']))
+                scans.append((labels, r['scans']))
+                valid.append((labels, int(bool(r['valid']))))
+
+            for r in idx_stat.iter_bloat():
+                labels = {'db': name, 'schema': r['schema'],
+                          'table': r['table'], 'index': r['index']}
+                bloat.append((labels, r['bloat']))
+                ratio.append((labels, r['ratio']))
+
+            up.append(({'db': name}, 1))
+        except Exception:
+            up.append(({'db': name}, 0))
+        finally:
+            idx_stat.close_connect()
+
+    lines = format_gauge('up', 'Whether the last collection '
+                         'of the database succeeded', up)
+    lines += format_gauge('index_size_bytes', 'Index size', size)
+    lines += format_gauge('index_scans', 'Number of index scans '
+                          'since the statistics reset', scans)
+    lines += format_gauge('index_valid', 'Whether the index is valid', valid)
+    lines += format_gauge('index_bloat_bytes', 'Estimated index bloat',
+                          bloat)
+    lines += format_gauge('index_bloat_ratio', 'Estimated index bloat '
+                          'in percent of the index size', ratio)
+
+    if history:
+        durations, reclaimed = {}, {}
+        for dbname, iname, amname, prev, fin, exec_time in \
+                history.get_samples():
+            key = (('amname', amname), ('db', dbname))
+            durations.setdefault(key, []).append(exec_time or 0)
+            reclaimed.setdefault(key, []).append(
+                max((prev or 0) - (fin or 0), 0))
+
+        lines += format_histogram('rebuild_duration_seconds',
+                                  'Duration of index rebuilds',
+                                  DURATION_BUCKETS, durations)
+        lines += format_histogram('rebuild_reclaimed_bytes',
+                                  'Space reclaimed by index rebuilds',
+                                  RECLAIMED_BUCKETS, reclaimed)
+
+    lines += format_gauge('last_collect_timestamp_seconds',
+                          'Time of the last collection',
+                          [({}, int(time.time()))])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+    """Class for serving metrics over HTTP.
+    The metrics are collected by a background thread
+    every interval seconds and scrapes are served from the cache,
+    so scraping never queries the databases
+    """
+    def __init__(self, collect, interval=60):
+        self.collect = collect
+        self.interval = interval
+        self.__lock = threading.Lock()
+        self.__text = ''
+        self.__collected = threading.Event()
+
+    def get_text(self):
+        with self.__lock:
+            return self.__text
+
+    def __collector(self):
+        while True:
+            start = time.time()
+            try:
+                text = self.collect()
+                with self.__lock:
+                    self.__text = text
+            except Exception as e:
+                print('%s: metrics collection failed: %s' % (
+                    datetime.datetime.now(), e))
+
+            self.__collected.set()
+            time.sleep(max(self.interval - (time.time() - start), 0))
+
+    def serve_forever(self, port, addr=''):
+        """Start the collector and serve /metrics on the port"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = exporter.get_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        t = threading.Thread(target=self.__collector, name='metrics-collector',
+                             daemon=True)
+        t.start()
+        # Don't serve an empty page before the first collection:
+        self.__collected.wait()
+
+        server = ThreadingHTTPServer((addr, port), Handler)
+        print('Serving metrics on %s:%s/metrics' % (addr or '*', port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,144 @@
+# planner - The index rebuilding planner
+# Date: 17-10-2026
+
+# Rebuilding throughput (bytes/sec) used to estimate rebuild time
+# when nothing better is known:
+DEFAULT_THROUGHPUT = 20 * 1024 ** 2
+
+
+def estimate_time(size, throughput=DEFAULT_THROUGHPUT):
+    """Estimate rebuild time (in seconds) of an index of the passed size"""
+    if throughput <= 0:
+        err = 'estimate_time(): throughput must be positive, '\
+              'passed %s' % throughput
+        raise ValueError(err)
+
+    return float(size) / throughput
+
+
+def select_targets(candidates, min_bloat=0, min_ratio=0, max_size=0,
+                   time_budget=0, throughput=DEFAULT_THROUGHPUT):
+    """Select indexes for rebuilding from the bloat estimate.
+
+    candidates - list of dictionaries with 'index', 'size', 'bloat'
+    and 'ratio' keys (see GlobIndexStat.get_bloat_stat()),
+    max_size and time_budget (in seconds) equal to 0 mean no limit.
+
+    The candidates passed the thresholds are ordered
+    by expected reclaimed bytes per second of rebuilding
+    and are taken while their total estimated time fits
+    the time budget. Returns a list of the selected candidates
+    with the 'est_time' key added
+    """
+    passed = []
+    for c in candidates:
+        if c['bloat'] < min_bloat or c['ratio'] < min_ratio:
+            continue
+
+        if max_size and c['size'] > max_size:
+            continue
+
+        c = dict(c)
+        c['est_time'] = estimate_time(c['size'], throughput)
+        passed.append(c)
+
+    passed.sort(key=lambda c: c['bloat'] / max(c['est_time'], 1e-6),
+                reverse=True)
+
+    selected = []
+    total_time = 0
+    for c in passed:
+        if time_budget and total_time + c['est_time'] > time_budget:
+            # A smaller index further in the list may still fit:
+            continue
+
+        selected.append(c)
+        total_time += c['est_time']
+
+    return selected
+
+
+def days_to_threshold(ratio, ratio_rate, threshold):
+    """Get the number of days until the bloat ratio (percent)
+    growing by ratio_rate percent a day reaches the threshold,
+    None if it doesn't grow
+    """
+    if ratio >= threshold:
+        return 0
+
+    if ratio_rate <= 0:
+        return None
+
+    return (threshold - ratio) / ratio_rate
+
+
+# The server default of maintenance_work_mem:
+DEFAULT_MAINT_MEM = 64 * 1024 ** 2
+
+
+def space_need(size, tablespace, temp_tablespace, maint_mem=0):
+    """Get extra disk space (bytes) a concurrent build of an index
+    of the passed size needs at its peak as a dictionary
+    {tablespace: bytes}: a new copy of the index and sort temp files
+    if the index doesn't fit maintenance_work_mem
+    """
+    need = {tablespace: size}
+    if size > (maint_mem or DEFAULT_MAINT_MEM):
+        need[temp_tablespace] = need.get(temp_tablespace, 0) + size
+
+    return need
+
+
+def space_budget(free, headroom=0):
+    """Get space (bytes) index builds can take in each tablespace
+    keeping headroom percent of the free space.
+    free - dictionary {tablespace: free bytes}
+    """
+    return dict((ts, int(f * (100 - headroom) / 100.0))
+                for ts, f in free.items())
+
+
+def fits(need, budget, used=None):
+    """Does the need fit the budget with the used space
+    (see space_need()), tablespaces missing in the budget
+    aren't limited
+    """
+    used = used or {}
+    return all(used.get(ts, 0) + n <= budget[ts]
+               for ts, n in need.items() if ts in budget)
+
+
+# Session tuning of index builds:
+MIN_MAINT_MEM = 64 * 1024 ** 2
+# Every parallel worker gets a part of maintenance_work_mem,
+# the server requires at least 32MB per participant:
+MIN_WORKER_MEM = 32 * 1024 ** 2
+# Index size per one parallel maintenance worker:
+PARALLEL_STEP = 1024 ** 3
+
+
+def tune_build(size, max_mem=0, max_workers=None, work_mem=0):
+    """Get session settings for building an index of the passed size.
+    maintenance_work_mem grows with the index size (a sort
+    of the whole index in memory needs about its size)
+    up to max_mem, parallel workers are added for each PARALLEL_STEP
+    of the size up to max_workers. Zero/None limits mean
+    the setting isn't changed. Returns a dictionary {setting: value}
+    """
+    settings = {}
+
+    mem = 0
+    if max_mem:
+        mem = min(max_mem, max(MIN_MAINT_MEM, size))
+        settings['maintenance_work_mem'] = '%dkB' % (mem // 1024)
+
+    if max_workers is not None:
+        workers = min(max_workers, size // PARALLEL_STEP)
+        if mem:
+            workers = min(workers, mem // MIN_WORKER_MEM - 1)
+        settings['max_parallel_maintenance_workers'] = max(int(workers), 0)
+
+    if work_mem:
+        settings['work_mem'] = '%dkB' % (work_mem // 1024)
+
+    return settings
@@ -0,0 +1,160 @@
+# redundancy - The analyzer of duplicate and redundant indexes
+# Date: 17-10-2026
+
+import itertools
+
+from lib.common import pretty_size
+
+# Columns of the findings (see find_redundant()):
+REDUNDANT_COLUMNS = ['kind', 'schema', 'table', 'index', 'size', 'scans',
+                     'writes', 'covered_by']
+
+
+def _keys(d):
+    """Get the key columns of the index definition
+    as (attnum, opclass, collation, option) tuples,
+    attnum 0 means an expression
+    """
+    n = d['nkeyatts']
+    return tuple(zip(d['indkey'][:n], d['indclass'][:n],
+                     d['indcollation'][:n], d['indoption'][:n]))
+
+
+def _included(d):
+    return frozenset(d['indkey'][d['nkeyatts']:])
+
+
+def _keeps_constraint(d):
+    return d['unique'] or d['primary']
+
+
+def _is_duplicate(a, b):
+    return (a['amname'] == b['amname'] and _keys(a) == _keys(b) and
+            a['exprs'] == b['exprs'] and a['pred'] == b['pred'] and
+            _included(a) == _included(b))
+
+
+def _is_prefix(a, b):
+    """Is the btree index a covered by the btree index b:
+    key columns of a are a leading part of key columns of b
+    and b contains all included columns of a
+    """
+    if a['amname'] != 'btree' or b['amname'] != 'btree':
+        return False
+
+    # A unique index enforces more than the wider one:
+    if _keeps_constraint(a) or a['pred'] != b['pred']:
+        return False
+
+    ka, kb = _keys(a), _keys(b)
+    if len(ka) >= len(kb) or kb[:len(ka)] != ka:
+        return False
+
+    # Expressions can't be matched column by column:
+    if a['exprs'] or b['exprs']:
+        return False
+
+    return _included(a) <= set(b['indkey'])
+
+
+def _is_partial_overlap(a, b):
+    """Is the partial index a covered by the full index b
+    with the same key columns. Predicates of two partial indexes
+    may select different rows, so they don't cover each other
+    """
+    return (a['pred'] is not None and b['pred'] is None and
+            a['amname'] == b['amname'] and _keys(a) == _keys(b) and
+            a['exprs'] == b['exprs'] and not _keeps_constraint(a) and
+            _included(a) <= _included(b))
+
+
+def _finding(kind, d, other):
+    return {'kind': kind,
+            'schema': d['schema'],
+            'table': d['table'],
+            'index': d['index'],
+            'size': d['size'],
+            'scans': d['scans'],
+            # Rows written since the statistics reset,
+            # the index is updated for each of them:
+            'writes': d['writes'],
+            'covered_by': other['index']}
+
+
+def analyze_table(defs):
+    """Find redundant indexes among the index definitions
+    of one table. Returns a list of findings, every redundant index
+    is reported once by the first matched kind:
+    duplicate - the same definition as another index,
+    prefix - key columns are a leading part of another index,
+    partial - a partial index with the same key columns
+    as a full index
+    """
+    findings = []
+    redundant = set()
+
+    # Among duplicates the constraint index, then the most used one
+    # is kept:
+    order = sorted(defs, key=lambda d: (not _keeps_constraint(d),
+                                        -d['scans'], d['index']))
+    for n, keep in enumerate(order):
+        if keep['index'] in redundant:
+            continue
+
+        for d in order[n + 1:]:
+            if d['index'] not in redundant and _is_duplicate(d, keep):
+                redundant.add(d['index'])
+                findings.append(_finding('duplicate', d, keep))
+
+    for kind, check in (('prefix', _is_prefix),
+                        ('partial', _is_partial_overlap)):
+        for a in defs:
+            if a['index'] in redundant:
+                continue
+
+            for b in defs:
+                if b is a or b['index'] in redundant:
+                    continue
+
+                if check(a, b):
+                    redundant.add(a['index'])
+                    findings.append(_finding(kind, a, b))
+                    break
+
+    return findings
+
+
+def find_redundant(defs):
+    """Yield findings of redundant indexes (see analyze_table()).
+    defs - index definitions ordered by table (see
+    GlobIndexStat.iter_index_defs()), they are analyzed table
+    by table, so only the indexes of one table are kept in memory
+    """
+    for relid, group in itertools.groupby(defs, key=lambda d: d['relid']):
+        for f in analyze_table(list(group)):
+            yield f
+
+
+def print_findings(findings):
+    """Print redundant indexes grouped by table with the totals"""
+    table = None
+    total_size = 0
+    count = 0
+    for f in findings:
+        if (f['schema'], f['table']) != table:
+            table = (f['schema'], f['table'])
+            print('\n%s.%s' % table)
+            print('-' * (len(f['schema']) + len(f['table']) + 1))
+
+        print('  {:{}{}} {:{}{}} {:{}{}} scans {:{}{}} writes {:{}{}} '
+              'covered by {}'.format(f['kind'], '<', '10', f['index'], '<',
+                                     '48', pretty_size(f['size']), '>', '10',
+                                     f['scans'], '<', '10', f['writes'],
+                                     '<', '12', f['covered_by']))
+        total_size += f['size']
+        count += 1
+
+    if not count:
+        print('No redundant indexes found')
+    else:
+        print('\n%s redundant indexes, %s' % (count, pretty_size(total_size)))
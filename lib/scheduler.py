@@ -0,0 +1,230 @@
+# scheduler - The index rebuilding scheduler
+# Date: 17-10-2026
+
+import threading
+
+from lib.planner import fits
+
+# How often (seconds) workers held by the gate check it again:
+GATE_POLL = 5
+
+
+class RebuildScheduler(object):
+    """Class for running index rebuilds by a pool of workers.
+    Rebuilds of indexes that belong to the same table
+    are never run at the same time because concurrent
+    index builds on one table wait for each other's snapshots
+    """
+    def __init__(self, jobs=1):
+        self.set_jobs(jobs)
+        self.__cond = threading.Condition()
+        self.__pending = []
+        self.__busy_tables = set()
+        self.__results = []
+        self.__running = 0
+        self.__used = {}
+        self.budget = None
+        self.cost = None
+        self.gates = []
+        # Items of the tasks dropped because a gate has been stopped:
+        self.skipped = []
+
+    def set_jobs(self, jobs):
+        if not isinstance(jobs, int) or jobs < 1:
+            err = 'RebuildScheduler.set_jobs(): '\
+                  'jobs must be a positive integer, passed %s' % jobs
+            raise ValueError(err)
+
+        self.jobs = jobs
+
+    def add_gate(self, gate):
+        """Add an object which admit(running) method is called
+        before every task is started with the number of running tasks.
+        While it returns False, the task is postponed. If the gate
+        has the stopped() method and it returns True, the pending
+        tasks are dropped (see the throttle module). The methods
+        are called by the workers at the same time and without
+        the scheduler lock, so a slow check doesn't hold the others
+        """
+        if not callable(getattr(gate, 'admit', None)):
+            err = 'RebuildScheduler.add_gate(): the gate must have '\
+                  'the admit() method, passed %s' % type(gate)
+            raise TypeError(err)
+
+        self.gates.append(gate)
+
+    def set_budget(self, budget, cost):
+        """Limit disk space taken by the running tasks at the same time.
+        budget - dictionary {tablespace: bytes},
+        cost(item) - function returning the need of the task
+        as a dictionary {tablespace: bytes} (see planner.space_need()).
+        A task is started only if its need fits the rest
+        of the budget, a single task is never held
+        """
+        self.budget = budget
+        self.cost = cost
+
+    def __fits(self, item):
+        if not self.budget or not self.__running:
+            return True
+
+        return fits(self.cost(item), self.budget, self.__used)
+
+    def __reserve(self, item, sign):
+        if not self.budget:
+            return
+
+        for ts, n in self.cost(item).items():
+            self.__used[ts] = self.__used.get(ts, 0) + sign * n
+
+    def __stopped(self):
+        return any(g.stopped() for g in self.gates
+                   if hasattr(g, 'stopped'))
+
+    def __admitted(self, running):
+        return all(g.admit(running) for g in self.gates)
+
+    def __next_task(self):
+        """Get the first pending task which table is free.
+        Wait if all the pending tasks are blocked by busy tables
+        or by the gate, return None when there are no pending tasks
+        """
+        while True:
+            with self.__cond:
+                if not self.__pending:
+                    return None
+                running = self.__running
+
+            # Gates may query the database, other workers
+            # finish and take tasks meanwhile:
+            stopped = self.__stopped()
+            admitted = stopped or self.__admitted(running)
+
+            with self.__cond:
+                if stopped:
+                    self.skipped += [task[1] for task in self.__pending]
+                    self.__pending = []
+                    self.__cond.notify_all()
+                    return None
+
+                # The gate has admitted fewer running tasks:
+                if self.__running > running:
+                    continue
+
+                if not admitted:
+                    self.__cond.wait(GATE_POLL)
+                    continue
+
+                for n, task in enumerate(self.__pending):
+                    if task[2] not in self.__busy_tables and \
+                            self.__fits(task[1]):
+                        del self.__pending[n]
+                        self.__busy_tables.add(task[2])
+                        self.__reserve(task[1], 1)
+                        self.__running += 1
+                        return task
+
+                if self.__pending:
+                    self.__cond.wait()
+
+    def __release(self, item, table):
+        with self.__cond:
+            self.__busy_tables.discard(table)
+            self.__reserve(item, -1)
+            self.__running -= 1
+            self.__cond.notify_all()
+
+    def __worker(self, func, make_session):
+        # Every worker keeps its own database session for all its tasks:
+        session = make_session() if make_session else None
+
+        while True:
+            task = self.__next_task()
+            if task is None:
+                break
+
+            pos, item, table = task
+            try:
+                if session:
+                    self.__results[pos] = func(item, session)
+                else:
+                    self.__results[pos] = func(item)
+            except Exception as e:
+                print('%s: %s' % (item, e))
+                self.__results[pos] = None
+            finally:
+                self.__release(item, table)
+
+        if session:
+            session.close_connect()
+
+    def run(self, tasks, func, make_session=None):
+        """Run func(item) for each (item, table) pair of the tasks list.
+        If make_session is passed, every worker creates its session
+        by calling it and runs func(item, session) instead.
+        Returns a list of the func results in the tasks order
+        """
+        # A task without a known table is independent of the others:
+        self.__pending = [(n, item, table if table else ('', item))
+                          for n, (item, table) in enumerate(tasks)]
+        self.__results = [None] * len(tasks)
+        self.__busy_tables = set()
+        self.__running = 0
+        self.__used = {}
+        self.skipped = []
+
+        workers = []
+        for n in range(min(self.jobs, len(tasks))):
+            w = threading.Thread(target=self.__worker,
+                                 args=(func, make_session),
+                                 name='rebuild-worker-%s' % n)
+            w.start()
+            workers.append(w)
+
+        for w in workers:
+            w.join()
+
+        return self.__results
+
+
+class FanOutScheduler(object):
+    """Class for running a function for many targets (databases)
+    concurrently, at most per_key targets with the same key (host)
+    are processed at the same time
+    """
+    def __init__(self, per_key=1):
+        if not isinstance(per_key, int) or per_key < 1:
+            err = 'FanOutScheduler(): per_key must be '\
+                  'a positive integer, passed %s' % per_key
+            raise ValueError(err)
+
+        self.per_key = per_key
+
+    def run(self, tasks, func):
+        """Run func(item) for each (item, key) pair of the tasks list.
+        Returns a list of the func results in the tasks order
+        """
+        results = [None] * len(tasks)
+        limits = {}
+        for item, key in tasks:
+            if key not in limits:
+                limits[key] = threading.BoundedSemaphore(self.per_key)
+
+        def worker(pos, item, key):
+            with limits[key]:
+                try:
+                    results[pos] = func(item)
+                except Exception as e:
+                    print('%s: %s' % (item, e))
+
+        threads = []
+        for pos, (item, key) in enumerate(tasks):
+            t = threading.Thread(target=worker, args=(pos, item, key),
+                                 name='fanout-%s' % pos)
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+        return results
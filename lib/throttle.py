@@ -0,0 +1,227 @@
+# throttle - The replication lag aware throttle of index rebuilds
+# Date: 17-10-2026
+
+import collections
+import datetime
+import threading
+import time
+
+from lib.database import INF, WRN
+
+
+class ReplicationThrottle(object):
+    """Class for adapting the number of concurrent rebuilds
+    to what the streaming replicas can keep up with.
+
+    The replay lag and the WAL generation rate of the primary
+    are checked at most every interval seconds by the passed
+    database object (see DatBaseObject.get_replication_stat()).
+    While the lag is above max_lag (seconds) or max_lag_bytes,
+    no new rebuilds are started and the allowed concurrency is halved;
+    while the WAL rate is above max_wal_rate (bytes/sec),
+    the concurrency is halved too. Every check without
+    an overload allows one more concurrent rebuild up to jobs.
+    Zero thresholds are not checked
+    """
+    def __init__(self, dbobj, jobs=1, max_lag=0, max_lag_bytes=0,
+                 max_wal_rate=0, interval=10):
+        self.dbobj = dbobj
+        self.jobs = jobs
+        self.max_lag = max_lag
+        self.max_lag_bytes = max_lag_bytes
+        self.max_wal_rate = max_wal_rate
+        self.interval = interval
+        self.limit = jobs
+        self.paused = False
+        self.last = None
+        self.wal_rate = 0
+        self.__lock = threading.Lock()
+
+    def __update(self):
+        stat = self.dbobj.get_replication_stat()
+        if stat is None:
+            return
+
+        if self.last:
+            elapsed = stat['time'] - self.last['time']
+            if elapsed > 0:
+                self.wal_rate = (stat['wal_pos'] -
+                                 self.last['wal_pos']) / elapsed
+        self.last = stat
+
+        lagging = ((self.max_lag and stat['lag'] > self.max_lag) or
+                   (self.max_lag_bytes and
+                    stat['lag_bytes'] > self.max_lag_bytes))
+        wal_burst = self.max_wal_rate and self.wal_rate > self.max_wal_rate
+
+        if lagging or wal_burst:
+            self.limit = max(self.limit // 2, 1)
+        else:
+            self.limit = min(self.limit + 1, self.jobs)
+
+        if lagging and not self.paused:
+            self.dbobj.logger('Replication lag %.1fs (%s bytes), '
+                              'new rebuilds are paused' % (
+                                  stat['lag'], stat['lag_bytes']), WRN)
+        elif self.paused and not lagging:
+            self.dbobj.logger('Replication lag %.1fs (%s bytes), '
+                              'rebuilds are resumed with concurrency %s' % (
+                                  stat['lag'], stat['lag_bytes'],
+                                  self.limit), INF)
+        self.paused = bool(lagging)
+
+    def check(self):
+        """Refresh the replication state if it's older than interval"""
+        with self.__lock:
+            if not self.last or time.time() - self.last['time'] >= \
+                    self.interval:
+                self.__update()
+
+            return not self.paused
+
+    def admit(self, running):
+        """Can a new rebuild be started while running ones are in
+        progress (see RebuildScheduler.add_gate())
+        """
+        if not self.check():
+            return False
+
+        return running < self.limit
+
+    def progress_hook(self, progress):
+        """Keep the state up to date during long builds
+        (see ProgressMonitor.add_hook())
+        """
+        if not self.check():
+            self.dbobj.logger('%s: replication lag %.1fs during '
+                              'the build' % (progress['iname'],
+                                             self.last['lag']), WRN)
+
+
+# The checkpoint rate is computed by the samples of the last hour
+# when they cover at least CHECKPOINT_MIN_SPAN seconds:
+CHECKPOINT_WINDOW = 3600
+CHECKPOINT_MIN_SPAN = 300
+
+
+class LoadGuard(object):
+    """Class for starting rebuilds only while the server isn't busy
+    and for stopping them at a wall-clock deadline.
+
+    The load is checked at most every interval seconds by the passed
+    database object (see DatBaseObject.get_load_stat()). New rebuilds
+    wait while active client backends (except the running rebuilds)
+    exceed max_active, backends waiting for locks exceed max_lock_waits,
+    blocks read and written exceed max_io_rate (bytes/sec)
+    or checkpoints exceed max_checkpoint_rate (per hour).
+    Zero limits are not checked. After the deadline (datetime)
+    no new rebuilds are started
+    """
+    def __init__(self, dbobj, max_active=0, max_lock_waits=0,
+                 max_io_rate=0, max_checkpoint_rate=0, deadline=None,
+                 interval=10):
+        self.dbobj = dbobj
+        self.max_active = max_active
+        self.max_lock_waits = max_lock_waits
+        self.max_io_rate = max_io_rate
+        self.max_checkpoint_rate = max_checkpoint_rate
+        self.deadline = deadline
+        self.interval = interval
+        self.busy = False
+        self.last = None
+        self.__samples = collections.deque()
+        self.__stop_logged = False
+        self.__lock = threading.Lock()
+
+    def __has_limits(self):
+        return (self.max_active or self.max_lock_waits or
+                self.max_io_rate or self.max_checkpoint_rate)
+
+    def __update(self, running):
+        stat = self.dbobj.get_load_stat()
+        if stat is None:
+            return
+
+        reasons = []
+        if self.max_active and stat['active'] - running > self.max_active:
+            reasons.append('%s active backends' % stat['active'])
+
+        if self.max_lock_waits and stat['lock_waits'] > self.max_lock_waits:
+            reasons.append('%s lock waits' % stat['lock_waits'])
+
+        if self.max_io_rate and self.last:
+            elapsed = stat['time'] - self.last['time']
+            io_rate = (stat['blocks'] - self.last['blocks']) * \
+                stat['block_size'] / elapsed if elapsed > 0 else 0
+            if io_rate > self.max_io_rate:
+                reasons.append('I/O %.1f MB/s' % (io_rate / 1024 ** 2))
+
+        self.__samples.append((stat['time'], stat['checkpoints']))
+        while stat['time'] - self.__samples[0][0] > CHECKPOINT_WINDOW:
+            self.__samples.popleft()
+
+        span = stat['time'] - self.__samples[0][0]
+        if self.max_checkpoint_rate and span >= CHECKPOINT_MIN_SPAN:
+            rate = (stat['checkpoints'] - self.__samples[0][1]) * 3600 / span
+            if rate > self.max_checkpoint_rate:
+                reasons.append('%.1f checkpoints/hour' % rate)
+
+        self.last = stat
+
+        if reasons and not self.busy:
+            self.dbobj.logger('Server is busy (%s), new rebuilds '
+                              'wait' % ', '.join(reasons), WRN)
+        elif self.busy and not reasons:
+            self.dbobj.logger('Server load is below the limits, '
+                              'rebuilds continue', INF)
+        self.busy = bool(reasons)
+
+    def admit(self, running):
+        """Can a new rebuild be started while running ones are in
+        progress (see RebuildScheduler.add_gate())
+        """
+        if self.stopped():
+            return False
+
+        if not self.__has_limits():
+            return True
+
+        with self.__lock:
+            if not self.last or time.time() - self.last['time'] >= \
+                    self.interval:
+                self.__update(running)
+
+            return not self.busy
+
+    def stopped(self):
+        """Is the deadline reached"""
+        if not self.deadline or datetime.datetime.now() < self.deadline:
+            return False
+
+        with self.__lock:
+            if not self.__stop_logged:
+                self.dbobj.logger('The deadline %s is reached, '
+                                  'new rebuilds are not started' %
+                                  self.deadline.strftime('%H:%M'), WRN)
+                self.__stop_logged = True
+
+        return True
+
+
+def next_time(hhmm, now=None):
+    """Get the nearest datetime after now
+    at the passed wall-clock time 'HH:MM'
+    """
+    try:
+        t = datetime.datetime.strptime(hhmm, '%H:%M')
+    except ValueError:
+        err = "next_time(): time must be passed as 'HH:MM', "\
+              "passed '%s'" % hhmm
+        raise ValueError(err)
+
+    now = now or datetime.datetime.now()
+    at = now.replace(hour=t.hour, minute=t.minute, second=0, microsecond=0)
+    if at <= now:
+        at += datetime.timedelta(days=1)
+
+    return at